@@ -0,0 +1,140 @@
+import bisect
+import logging
+from typing import Callable, Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+PART_SEPARATOR = "#part"
+
+
+class BatchPlan:
+    def __init__(self, batches: List[List[Tuple[str, str]]], split_nodes: Dict[str, int], total_tokens: int, max_tokens: int):
+        # Each batch is a list of (node_id, text); windows of split nodes use part ids
+        self.batches = batches
+        # node_id -> number of windows, for nodes too large for a single request
+        self.split_nodes = split_nodes
+        self.total_tokens = total_tokens
+        self.max_tokens = max_tokens
+
+    @property
+    def efficiency(self) -> float:
+        """Share of the planned token capacity that is actually filled (1.0 = every batch full)."""
+        if not self.batches:
+            return 1.0
+        return self.total_tokens / (len(self.batches) * self.max_tokens)
+
+
+class BatchPlanner:
+    """Packs texts into as few LLM requests as possible under a token budget (best-fit decreasing)."""
+
+    def __init__(
+        self,
+        count_tokens_many: Callable[[Sequence[str]], List[int]],
+        max_tokens: int = 16000,
+        item_overhead: int = 20,
+    ):
+        self.count_tokens_many = count_tokens_many
+        self.max_tokens = max_tokens
+        # Tokens spent on the node_id header and code fences around every snippet
+        self.item_overhead = item_overhead
+
+    @staticmethod
+    def part_id(node_id: str, index: int) -> str:
+        return f"{node_id}{PART_SEPARATOR}{index}"
+
+    @staticmethod
+    def parse_part_id(part_id: str) -> Tuple[str, int]:
+        node_id, index = part_id.rsplit(PART_SEPARATOR, 1)
+        return node_id, int(index)
+
+    @staticmethod
+    def is_part_id(node_id: str) -> bool:
+        return PART_SEPARATOR in node_id
+
+    def plan(self, texts: Dict[str, str]) -> BatchPlan:
+        node_ids = list(texts)
+        token_counts = self.count_tokens_many([texts[node_id] for node_id in node_ids])
+
+        items = []
+        split_nodes = {}
+        for node_id, tokens in zip(node_ids, token_counts):
+            if tokens + self.item_overhead <= self.max_tokens:
+                items.append((tokens + self.item_overhead, node_id, texts[node_id]))
+                continue
+            windows = self.split_text(texts[node_id])
+            logger.warning(
+                f"Node {node_id} - {tokens} tokens, has exceeded the max_tokens limit. Splitting into {len(windows)} parts..."
+            )
+            split_nodes[node_id] = len(windows)
+            window_tokens = self.count_tokens_many(windows)
+            for index, (window, tokens) in enumerate(zip(windows, window_tokens)):
+                header = f"(Part {index + 1} of {len(windows)} of a larger code block)\n"
+                items.append(
+                    (
+                        min(tokens + self.item_overhead + 16, self.max_tokens),
+                        self.part_id(node_id, index),
+                        header + window,
+                    )
+                )
+
+        # Best-fit decreasing: place each item in the open batch with the least room that still fits it
+        items.sort(key=lambda item: item[0], reverse=True)
+        batches = []
+        remaining = []  # sorted (room_left, batch_index)
+        for tokens, node_id, text in items:
+            position = bisect.bisect_left(remaining, (tokens, -1))
+            if position < len(remaining):
+                room, batch_index = remaining.pop(position)
+            else:
+                batches.append([])
+                room, batch_index = self.max_tokens, len(batches) - 1
+            batches[batch_index].append((node_id, text))
+            bisect.insort(remaining, (room - tokens, batch_index))
+
+        plan = BatchPlan(batches, split_nodes, sum(item[0] for item in items), self.max_tokens)
+        print(
+            f"Batched {len(items)} items into {len(batches)} batches "
+            f"(packing efficiency {plan.efficiency:.1%}, {len(split_nodes)} nodes split)"
+        )
+        return plan
+
+    def split_text(self, text: str) -> List[str]:
+        """Splits text into consecutive line windows that each fit in one request."""
+        budget = self.max_tokens - self.item_overhead - 16
+        lines = text.split("\n")
+        line_tokens = self.count_tokens_many(lines)
+        windows = []
+        current, current_tokens = [], 0
+        for line, tokens in zip(lines, line_tokens):
+            tokens += 1  # newline
+            if tokens > budget:
+                # A single huge line (minified code, data blobs): cut it by characters
+                if current:
+                    windows.append("\n".join(current))
+                    current, current_tokens = [], 0
+                chunk_chars = budget * 3
+                windows.extend(line[i : i + chunk_chars] for i in range(0, len(line), chunk_chars))
+                continue
+            if current_tokens + tokens > budget:
+                windows.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(line)
+            current_tokens += tokens
+        if current:
+            windows.append("\n".join(current))
+        return windows
+
+    @staticmethod
+    def summary_text(original_text: str, part_docstrings: Dict[int, str], part_count: int) -> str:
+        """Text for the hierarchical pass: the node's first line plus the docstrings of its parts."""
+        signature = original_text.split("\n", 1)[0]
+        summaries = "\n".join(
+            f"Part {index + 1}/{part_count}: {part_docstrings[index]}"
+            for index in sorted(part_docstrings)
+        )
+        return (
+            f"{signature}\n"
+            "// This code block was too large to document in one request.\n"
+            "// Document it as a whole from these summaries of its consecutive parts:\n"
+            f"{summaries}"
+        )
@@ -0,0 +1,137 @@
+import csv
+import os
+import re
+from typing import Dict, Iterable
+
+NODE_FIELDS = ["name", "file_path", "start_line", "end_line", "repoId", "type", "text", "text_hash"]
+INT_FIELDS = {"start_line", "end_line"}
+
+IMPORT_SCRIPT = """#!/usr/bin/env sh
+# Offline initial load with neo4j-admin. The database must be stopped (or not exist yet);
+# it is overwritten. Afterwards start it and run InferenceService.run_inference().
+set -e
+DIR="$(cd "$(dirname "$0")" && pwd)"
+neo4j-admin database import full "${{NEO4J_DATABASE:-neo4j}}" \\
+    --nodes="$DIR/{nodes_file}" \\
+    --relationships="$DIR/{relationships_file}" \\
+    --multiline-fields=true \\
+    --skip-duplicate-nodes=true \\
+    --overwrite-destination=true
+"""
+
+LOAD_CSV_SCRIPT = """// Online load into a running database, e.g.
+//   cypher-shell -f load_csv.cypher
+// Copy {nodes_file} and {relationships_file} into the server's import directory first.
+CREATE INDEX node_id_repo IF NOT EXISTS FOR (n:NODE) ON (n.node_id, n.repoId);
+
+LOAD CSV WITH HEADERS FROM 'file:///{nodes_file}' AS row
+CALL {{
+    WITH row
+    CALL apoc.create.node(split(row.`:LABEL`, ';'), {{
+        node_id: row.`{id_column}`,
+        name: row.name,
+        file_path: row.file_path,
+        start_line: toInteger(row.`start_line:int`),
+        end_line: toInteger(row.`end_line:int`),
+        repoId: row.repoId,
+        type: row.type,
+        text: row.text,
+        text_hash: row.text_hash
+    }}) YIELD node
+    RETURN count(*) AS created_count
+}} IN TRANSACTIONS OF {rows_per_transaction} ROWS
+RETURN sum(created_count);
+
+LOAD CSV WITH HEADERS FROM 'file:///{relationships_file}' AS row
+CALL {{
+    WITH row
+    MATCH (source:NODE {{node_id: row.`{start_column}`, repoId: row.repoId}})
+    MATCH (target:NODE {{node_id: row.`{end_column}`, repoId: row.repoId}})
+    CALL apoc.create.relationship(source, row.`:TYPE`, {{repoId: row.repoId}}, target) YIELD rel
+    RETURN count(rel) AS created_count
+}} IN TRANSACTIONS OF {rows_per_transaction} ROWS
+RETURN sum(created_count);
+"""
+
+
+class BulkImportExporter:
+    """Writes graph nodes and relationships as neo4j-admin import CSVs, plus a LOAD CSV script."""
+
+    nodes_file = "nodes.csv"
+    relationships_file = "relationships.csv"
+
+    def __init__(self, output_dir: str, project_id: str = "default", rows_per_transaction: int = 10000):
+        self.output_dir = output_dir
+        self.project_id = project_id
+        self.rows_per_transaction = rows_per_transaction
+        # neo4j-admin resolves relationship endpoints within an ID group, one per repository
+        self.id_group = re.sub(r"[^A-Za-z0-9_]", "_", project_id)
+
+    @property
+    def node_header(self) -> list:
+        return (
+            [f"node_id:ID({self.id_group})"]
+            + [f"{field}:int" if field in INT_FIELDS else field for field in NODE_FIELDS]
+            + [":LABEL"]
+        )
+
+    @property
+    def relationship_header(self) -> list:
+        return [f":START_ID({self.id_group})", f":END_ID({self.id_group})", ":TYPE", "repoId"]
+
+    def export(self, nodes: Iterable[Dict], edges: Iterable[Dict]) -> Dict[str, str]:
+        """Streams prepared nodes and edges (see ``InferenceService.prepare_node``/``prepare_edge``) to disk."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        nodes_path = os.path.join(self.output_dir, self.nodes_file)
+        relationships_path = os.path.join(self.output_dir, self.relationships_file)
+
+        exported_ids = set()
+        with open(nodes_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+            writer.writerow(self.node_header)
+            for node in nodes:
+                if node["node_id"] in exported_ids:
+                    continue
+                exported_ids.add(node["node_id"])
+                writer.writerow(
+                    [node["node_id"]]
+                    + [node.get(field, "") for field in NODE_FIELDS]
+                    + [";".join(node["labels"])]
+                )
+
+        relationship_count = 0
+        with open(relationships_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+            writer.writerow(self.relationship_header)
+            for edge in edges:
+                # Same as the MATCH in store_graph_to_neo4j: dangling edges are not stored
+                if edge["source_id"] not in exported_ids or edge["target_id"] not in exported_ids:
+                    continue
+                writer.writerow([edge["source_id"], edge["target_id"], edge["type"], edge["repoId"]])
+                relationship_count += 1
+
+        script_args = dict(
+            nodes_file=self.nodes_file,
+            relationships_file=self.relationships_file,
+            id_column=self.node_header[0],
+            start_column=self.relationship_header[0],
+            end_column=self.relationship_header[1],
+            rows_per_transaction=self.rows_per_transaction,
+        )
+        import_script_path = os.path.join(self.output_dir, "import.sh")
+        with open(import_script_path, "w", encoding="utf-8") as f:
+            f.write(IMPORT_SCRIPT.format(**script_args))
+        os.chmod(import_script_path, 0o755)
+        load_csv_path = os.path.join(self.output_dir, "load_csv.cypher")
+        with open(load_csv_path, "w", encoding="utf-8") as f:
+            f.write(LOAD_CSV_SCRIPT.format(**script_args))
+
+        print(
+            f"Exported {len(exported_ids)} nodes and {relationship_count} relationships to {self.output_dir}"
+        )
+        return {
+            "nodes": nodes_path,
+            "relationships": relationships_path,
+            "import_script": import_script_path,
+            "load_csv_script": load_csv_path,
+        }
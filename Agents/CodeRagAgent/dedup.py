@@ -0,0 +1,116 @@
+import hashlib
+import os
+import re
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional
+
+TOKEN_PATTERN = re.compile(
+    r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|[A-Za-z_$][A-Za-z0-9_$]*|\d+(?:\.\d+)?|\S'
+)
+
+# Kept verbatim when normalizing, so only names are abstracted away (Java, Python, JS/TS)
+KEYWORDS = frozenset(
+    """
+    abstract assert boolean break byte case catch char class const continue default do double else enum
+    extends final finally float for goto if implements import instanceof int interface long native new
+    package private protected public return short static strictfp super switch synchronized this throw
+    throws transient try void volatile while var record yield sealed permits true false null
+    and as async await def del elif except from global in is lambda nonlocal not or pass raise with
+    None True False self cls function let typeof undefined export extends of
+    """.split()
+)
+
+# Shorter names (i, id, x) are too likely to be plain words in a docstring to be substituted
+MIN_RENAMED_IDENTIFIER_LENGTH = 3
+
+
+def dedup_enabled() -> bool:
+    return os.getenv("DEDUP_DOCSTRINGS", "1") == "1"
+
+
+# Keywords after which ``name(`` is a call (``return save(x)``), not a declaration (``void save(``)
+CALL_CONTEXT_KEYWORDS = frozenset("return new await throw yield in not and or is else case print".split())
+
+
+def _is_identifier(token: Optional[str]) -> bool:
+    return bool(token) and (token[0].isalpha() or token[0] in "_$")
+
+
+def _is_member_access(tokens: List[str], index: int) -> bool:
+    previous = tokens[index - 1] if index > 0 else None
+    before = tokens[index - 2] if index > 1 else None
+    return previous == "." or (previous, before) in ((">", "-"), (":", ":"))
+
+
+def _is_call(tokens: List[str], index: int) -> bool:
+    """``name(`` that invokes ``name`` rather than declaring it."""
+    if index + 1 >= len(tokens) or tokens[index + 1] != "(":
+        return False
+    previous = tokens[index - 1] if index > 0 else None
+    if previous is None:
+        return False
+    if _is_identifier(previous):
+        return previous in CALL_CONTEXT_KEYWORDS
+    return previous not in (">", "]", "*")
+
+
+def normalize(text: str):
+    """Returns (hash of the normalized text, identifiers in order of first appearance)."""
+    # Local names become their first-appearance index (getName/getAge collide);
+    # called names and member accesses stay verbatim (repo.save/repo.delete don't).
+    identifiers: Dict[str, int] = {}
+    raw_tokens = TOKEN_PATTERN.findall(text)
+    tokens = []
+    for index, token in enumerate(raw_tokens):
+        if (
+            _is_identifier(token)
+            and token not in KEYWORDS
+            and not _is_member_access(raw_tokens, index)
+            and not _is_call(raw_tokens, index)
+        ):
+            tokens.append(f"#{identifiers.setdefault(token, len(identifiers))}")
+        else:
+            tokens.append(token)
+    key = hashlib.sha256(" ".join(tokens).encode("utf-8")).hexdigest()
+    return key, list(identifiers)
+
+
+class DuplicateGroups(NamedTuple):
+    # Representative node_id -> the other node_ids with the same normalized text
+    members: Dict[str, List[str]]
+    identifiers: Dict[str, List[str]]
+
+    def member_ids(self):
+        return {member for members in self.members.values() for member in members}
+
+
+def group_duplicates(texts: Dict[str, str], kinds: Optional[Dict[str, str]] = None) -> DuplicateGroups:
+    """Groups node texts that are equal after normalization; ``kinds`` (node types) must match too."""
+    kinds = kinds or {}
+    groups = defaultdict(list)
+    identifiers = {}
+    for node_id, text in texts.items():
+        key, identifiers[node_id] = normalize(text)
+        groups[(kinds.get(node_id), key)].append(node_id)
+    members = {node_ids[0]: node_ids[1:] for node_ids in groups.values() if len(node_ids) > 1}
+    return DuplicateGroups(
+        members=members,
+        identifiers={
+            node_id: identifiers[node_id]
+            for representative, node_ids in members.items()
+            for node_id in [representative, *node_ids]
+        },
+    )
+
+
+def rename_docstring(docstring: str, source_identifiers: List[str], target_identifiers: List[str]) -> str:
+    """Rewrites a representative's docstring for a duplicate by swapping the names that differ."""
+    renames = {
+        source: target
+        for source, target in zip(source_identifiers, target_identifiers)
+        if source != target and len(source) >= MIN_RENAMED_IDENTIFIER_LENGTH
+    }
+    if not renames:
+        return docstring
+    pattern = re.compile(r"\b(" + "|".join(re.escape(name) for name in sorted(renames, key=len, reverse=True)) + r")\b")
+    return pattern.sub(lambda match: renames[match.group(1)], docstring)
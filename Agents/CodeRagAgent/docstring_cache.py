@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+class CachedDocstring(NamedTuple):
+    docstring: str
+    tags: List[str]
+    embedding: Optional[List[float]]
+
+
+class DocstringCache:
+    """SQLite store of (content hash, prompt version, model) -> (docstring, tags, embedding) that outlives the graph."""
+
+    # SQLite's default limit on host parameters is 999
+    lookup_chunk_size = 500
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("DOCSTRING_CACHE_PATH", os.path.join(".cache", "docstrings.sqlite"))
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS docstrings (
+                    content_hash TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    docstring TEXT NOT NULL,
+                    tags TEXT NOT NULL,
+                    embedding BLOB,
+                    embedding_model TEXT,
+                    PRIMARY KEY (content_hash, prompt_version, model)
+                )
+                """
+            )
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(docstrings)")}
+            if "embedding_model" not in columns:
+                # Caches written before embeddings were tagged; their vectors are re-embedded once
+                self.conn.execute("ALTER TABLE docstrings ADD COLUMN embedding_model TEXT")
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(
+        self, hashes: Iterable[str], prompt_version: str, model: str, embedding_model: Optional[str] = None
+    ) -> Dict[str, CachedDocstring]:
+        hashes = list(set(hashes))
+        found = {}
+        with self._lock:
+            for i in range(0, len(hashes), self.lookup_chunk_size):
+                chunk = hashes[i : i + self.lookup_chunk_size]
+                rows = self.conn.execute(
+                    f"""
+                    SELECT content_hash, docstring, tags, embedding, embedding_model FROM docstrings
+                    WHERE prompt_version = ? AND model = ?
+                    AND content_hash IN ({",".join("?" * len(chunk))})
+                    """,
+                    [prompt_version, model, *chunk],
+                )
+                for content_hash, docstring, tags, embedding, stored_embedding_model in rows:
+                    found[content_hash] = CachedDocstring(
+                        docstring=docstring,
+                        tags=json.loads(tags),
+                        embedding=(
+                            array("f", embedding).tolist()
+                            if embedding and stored_embedding_model == embedding_model
+                            else None
+                        ),
+                    )
+        return found
+
+    def put_many(
+        self,
+        entries: Iterable[Tuple[str, str, List[str], Optional[List[float]]]],
+        prompt_version: str,
+        model: str,
+        embedding_model: Optional[str] = None,
+    ):
+        """Stores ``(content_hash, docstring, tags, embedding)`` tuples, replacing older values."""
+        rows = [
+            (
+                content_hash,
+                prompt_version,
+                model,
+                docstring,
+                json.dumps(tags or []),
+                array("f", embedding).tobytes() if embedding is not None else None,
+                embedding_model if embedding is not None else None,
+            )
+            for content_hash, docstring, tags, embedding in entries
+        ]
+        if not rows:
+            return
+        with self._lock, self.conn:
+            self.conn.executemany(
+                """
+                INSERT OR REPLACE INTO docstrings
+                (content_hash, prompt_version, model, docstring, tags, embedding, embedding_model)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
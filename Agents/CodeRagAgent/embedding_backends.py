@@ -0,0 +1,152 @@
+import logging
+import os
+from typing import Sequence
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("sentence-transformers", "onnx", "onnx-int8")
+# Minimum mean cosine similarity of each ONNX backend against the PyTorch vectors
+PARITY_THRESHOLDS = {"onnx": 0.999, "onnx-int8": 0.97}
+
+
+class EmbeddingBackend:
+    """Turns texts into L2-normalized float32 vectors."""
+
+    name = "base"
+    # Numeric precision of the weights; vectors from different precisions are not interchangeable
+    precision = "fp32"
+
+    def encode(self, texts: Sequence[str], batch_size: int = 64) -> np.ndarray:
+        raise NotImplementedError
+
+    def get_sentence_embedding_dimension(self) -> int:
+        raise NotImplementedError
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    name = "sentence-transformers"
+
+    def __init__(self, model_name: str, device: str = "cpu"):
+        # Imported here so ONNX deployments never pay for importing torch
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device=device)
+
+    def encode(self, texts: Sequence[str], batch_size: int = 64) -> np.ndarray:
+        return self.model.encode(
+            list(texts),
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        ).astype(np.float32, copy=False)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+
+class OnnxBackend(EmbeddingBackend):
+    """ONNX Runtime port of a sentence-transformers mean-pooling model; ``quantized`` loads the int8 graph."""
+
+    name = "onnx"
+
+    def __init__(self, model_dir: str, quantized: bool = False, max_length: int = 256, threads: int = None):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        model_file = "model_int8.onnx" if quantized else "model.onnx"
+        self.name = "onnx-int8" if quantized else "onnx"
+        self.precision = "int8" if quantized else "fp32"
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads or int(os.getenv("ONNX_THREADS", os.cpu_count() or 1))
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.dimension = self.session.get_outputs()[0].shape[-1]
+
+    def encode(self, texts: Sequence[str], batch_size: int = 64) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        # Sorting by length keeps padding inside each batch small
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        result = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            indices = order[start : start + batch_size]
+            encodings = self.tokenizer.encode_batch([texts[i] for i in indices])
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            inputs = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": attention_mask,
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            token_embeddings = self.session.run(
+                None, {name: value for name, value in inputs.items() if name in self.input_names}
+            )[0]
+            # Mean pooling over real tokens, then L2 normalization, as in the sentence-transformers pipeline
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            result[indices] = pooled
+        return result
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+
+def export_onnx_model(model_name: str, output_dir: str, quantize: bool = True) -> str:
+    """Exports a Hugging Face sentence-transformers model to ONNX (plus an int8 copy)."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    hub_name = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(hub_name)
+    model = AutoModel.from_pretrained(hub_name)
+    model.eval()
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["export"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    model_path = os.path.join(output_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                **{name: {0: "batch", 1: "sequence"} for name in input_names},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=14,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(model_path, os.path.join(output_dir, "model_int8.onnx"), weight_type=QuantType.QInt8)
+    print(f"Exported {hub_name} to {output_dir}")
+    return output_dir
+
+
+def create_embedding_backend(model_name: str, backend: str = None) -> EmbeddingBackend:
+    """Builds the backend chosen by ``EMBEDDING_BACKEND`` (sentence-transformers, onnx or onnx-int8)."""
+    backend = backend or os.getenv("EMBEDDING_BACKEND", "sentence-transformers")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend}, expected one of {BACKENDS}")
+    if backend == "sentence-transformers":
+        return SentenceTransformerBackend(model_name)
+
+    model_dir = os.getenv("EMBEDDING_ONNX_DIR", os.path.join(".cache", "onnx", model_name.replace("/", "_")))
+    quantized = backend == "onnx-int8"
+    model_file = "model_int8.onnx" if quantized else "model.onnx"
+    if not os.path.exists(os.path.join(model_dir, model_file)):
+        logger.warning(f"No ONNX model in {model_dir}, exporting {model_name} once")
+        export_onnx_model(model_name, model_dir, quantize=quantized)
+    return OnnxBackend(model_dir, quantized=quantized)
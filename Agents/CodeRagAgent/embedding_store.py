@@ -0,0 +1,135 @@
+import hashlib
+import os
+import threading
+from typing import Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from Agents.CodeRagAgent.vector_search import safe_file_name
+
+INT8_SCALE = 127.0
+
+
+class EmbeddingStore:
+    """Content-hash keyed embedding cache kept on disk as a memory-mapped float16 or int8 matrix."""
+
+    def __init__(
+        self,
+        namespace: str,
+        dim: int = 384,
+        dtype: str = None,
+        directory: Optional[str] = None,
+    ):
+        self.dim = dim
+        self.dtype = np.dtype(dtype or os.getenv("EMBEDDING_CACHE_DTYPE", "float16"))
+        if self.dtype not in (np.dtype("float16"), np.dtype("int8")):
+            raise ValueError(f"Unsupported embedding cache dtype: {self.dtype}")
+        base_directory = directory or os.getenv("EMBEDDING_CACHE_DIR", os.path.join(".cache", "embeddings"))
+        self.directory = os.path.join(
+            base_directory, f"{safe_file_name(namespace)}-{self.dtype.name}"
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        # Rows are appended to vectors.bin and read through np.memmap; only the <hash> <row> log is in memory
+        self.vectors_path = os.path.join(self.directory, "vectors.bin")
+        self.index_path = os.path.join(self.directory, "index.log")
+        self.row_bytes = self.dim * self.dtype.itemsize
+        self._lock = threading.RLock()
+        self._mmap = None
+        self._rows = {}
+        self._load_index()
+        # Rows appended twice (concurrent writers) are dead weight; compact when they dominate
+        if self.row_count > 2 * max(len(self._rows), 1024):
+            self.compact()
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    @property
+    def row_count(self) -> int:
+        if not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // self.row_bytes
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _load_index(self):
+        self._rows = {}
+        if not os.path.exists(self.index_path):
+            return
+        row_count = self.row_count
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1].isdigit() and int(parts[1]) < row_count:
+                    self._rows[parts[0]] = int(parts[1])
+
+    def _matrix(self) -> Optional[np.ndarray]:
+        row_count = self.row_count
+        if row_count == 0:
+            return None
+        if self._mmap is None or self._mmap.shape[0] != row_count:
+            self._mmap = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(row_count, self.dim))
+        return self._mmap
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self.dtype == np.dtype("int8"):
+            return np.clip(np.rint(vectors * INT8_SCALE), -127, 127).astype(np.int8)
+        return vectors.astype(np.float16)
+
+    def _decode(self, rows: np.ndarray) -> np.ndarray:
+        if self.dtype == np.dtype("int8"):
+            return rows.astype(np.float32) / INT8_SCALE
+        return rows.astype(np.float32)
+
+    def get_many(self, texts: Sequence[str]) -> Tuple[np.ndarray, List[int]]:
+        """Returns (float32 matrix with a row per text, indices of texts that were not cached)."""
+        keys = [self.key(text) for text in texts]
+        result = np.zeros((len(texts), self.dim), dtype=np.float32)
+        with self._lock:
+            found = [(i, self._rows[key]) for i, key in enumerate(keys) if key in self._rows]
+            if found:
+                matrix = self._matrix()
+                positions, rows = zip(*found)
+                result[list(positions)] = self._decode(matrix[list(rows)])
+        found_positions = {i for i, _ in found}
+        missing = [i for i in range(len(texts)) if i not in found_positions]
+        return result, missing
+
+    def put_many(self, texts: Sequence[str], vectors: np.ndarray):
+        with self._lock:
+            entries = []
+            seen = set()
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                if key in self._rows or key in seen:
+                    continue
+                seen.add(key)
+                entries.append((key, vector))
+            if not entries:
+                return
+            encoded = self._encode(np.asarray([vector for _, vector in entries], dtype=np.float32))
+            with open(self.vectors_path, "ab") as f:
+                first_row = f.tell() // self.row_bytes
+                f.write(encoded.tobytes())
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{key} {first_row + i}\n" for i, (key, _) in enumerate(entries)))
+            for i, (key, _) in enumerate(entries):
+                self._rows[key] = first_row + i
+
+    def compact(self, keep_keys: Optional[Iterable[str]] = None):
+        """Rewrites the matrix with one row per live key, optionally only the keys in ``keep_keys``."""
+        with self._lock:
+            keys = list(self._rows) if keep_keys is None else [key for key in set(keep_keys) if key in self._rows]
+            matrix = self._matrix()
+            tmp_vectors = self.vectors_path + ".tmp"
+            tmp_index = self.index_path + ".tmp"
+            with open(tmp_vectors, "wb") as f:
+                if keys:
+                    f.write(np.ascontiguousarray(matrix[[self._rows[key] for key in keys]]).tobytes())
+            with open(tmp_index, "w", encoding="utf-8") as f:
+                f.write("".join(f"{key} {row}\n" for row, key in enumerate(keys)))
+            self._mmap = None
+            os.replace(tmp_vectors, self.vectors_path)
+            os.replace(tmp_index, self.index_path)
+            self._rows = {key: row for row, key in enumerate(keys)}
+            print(f"Compacted embedding cache to {len(keys)} vectors")
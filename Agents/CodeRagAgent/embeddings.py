@@ -0,0 +1,112 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Sequence
+import numpy as np
+from Agents.CodeRagAgent.embedding_backends import EmbeddingBackend
+from Agents.CodeRagAgent.embedding_store import EmbeddingStore
+
+
+class _MicroBatcher:
+    """Collects embed requests made on one event loop and encodes them together."""
+
+    def __init__(self, service: "EmbeddingService", loop: asyncio.AbstractEventLoop):
+        self.service = service
+        self.loop = loop
+        self.pending = []  # (texts, future)
+        self.pending_count = 0
+        self.timer = None
+
+    def submit(self, texts: Sequence[str]) -> asyncio.Future:
+        future = self.loop.create_future()
+        self.pending.append((list(texts), future))
+        self.pending_count += len(texts)
+        if self.pending_count >= self.service.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.loop.call_later(self.service.max_wait, self.flush)
+        return future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        requests, self.pending, self.pending_count = self.pending, [], 0
+        self.loop.create_task(self._encode(requests))
+
+    async def _encode(self, requests):
+        texts = [text for request_texts, _ in requests for text in request_texts]
+        try:
+            vectors = await self.service.aencode_many(texts)
+        except Exception as e:
+            for _, future in requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        offset = 0
+        for request_texts, future in requests:
+            if not future.done():
+                future.set_result(vectors[offset : offset + len(request_texts)])
+            offset += len(request_texts)
+
+
+class EmbeddingService:
+    """Batched, L2-normalized sentence embeddings computed off the event loop."""
+
+    def __init__(
+        self,
+        model: EmbeddingBackend,
+        store: EmbeddingStore = None,
+        batch_size: int = None,
+        max_batch: int = None,
+        max_wait_ms: float = None,
+        workers: int = None,
+    ):
+        self.model = model
+        self.store = store
+        self.batch_size = batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+        self.max_batch = max_batch or int(os.getenv("EMBEDDING_MAX_BATCH", 1024))
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else float(os.getenv("EMBEDDING_MAX_WAIT_MS", 20))) / 1000
+        # torch already parallelizes inside an encode call, so one worker is usually best
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or int(os.getenv("EMBEDDING_WORKERS", 1)),
+            thread_name_prefix="embedding",
+        )
+        self._batchers = {}
+
+    def encode_many(self, texts: Sequence[str]) -> np.ndarray:
+        # Texts embedded before, in any run, come from the store without the model
+        if self.store is None:
+            return self._encode(texts)
+        vectors, missing = self.store.get_many(texts)
+        if missing:
+            # Each distinct text goes through the model once
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            encoded = self._encode(missing_texts)
+            rows = {text: row for row, text in enumerate(missing_texts)}
+            vectors[missing] = encoded[[rows[texts[i]] for i in missing]]
+            self.store.put_many(missing_texts, encoded)
+        return vectors
+
+    def _encode(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        return self.model.encode(texts, batch_size=self.batch_size)
+
+    async def aencode_many(self, texts: Sequence[str]) -> np.ndarray:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.encode_many, list(texts))
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        # Requests from concurrent tasks arriving within max_wait are merged into one encode call
+        if not texts:
+            return await self.aencode_many([])
+        loop = asyncio.get_running_loop()
+        batcher = self._batchers.get(loop)
+        if batcher is None:
+            batcher = self._batchers[loop] = _MicroBatcher(self, loop)
+        return await batcher.submit(texts)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,69 @@
+import os
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+from Agents.CodeRagAgent.utils import generate_node_id
+
+# Bump whenever the flow prompt changes so cached flow summaries are regenerated
+FLOW_PROMPT_VERSION = "flow-1"
+
+
+def flows_enabled() -> bool:
+    return os.getenv("FLOW_SUMMARIES", "1") == "1"
+
+
+def flow_node_id(entry_point_id: str) -> str:
+    return generate_node_id(f"FLOW:{entry_point_id}")
+
+
+def call_graph(function_ids: Iterable[str], calls: Iterable[Tuple[str, str]]):
+    """Callee lists and the set of called functions, restricted to ``function_ids``."""
+    functions = set(function_ids)
+    callees: Dict[str, List[str]] = defaultdict(list)
+    called: Set[str] = set()
+    for caller, callee in calls:
+        if caller == callee or caller not in functions or callee not in functions:
+            continue
+        callees[caller].append(callee)
+        called.add(callee)
+    return callees, called
+
+
+def entry_points(function_ids: Iterable[str], calls: Iterable[Tuple[str, str]]) -> List[str]:
+    """Functions that call others but are called by none."""
+    callees, called = call_graph(function_ids, calls)
+    return [function_id for function_id in sorted(callees) if function_id not in called]
+
+
+def find_flows(
+    function_ids: Iterable[str],
+    calls: Iterable[Tuple[str, str]],
+    max_depth: int = None,
+    max_nodes: int = None,
+) -> Dict[str, List[str]]:
+    """Entry point -> functions it reaches through ``calls`` (caller, callee), in breadth-first order."""
+    # Depth and size caps keep a dispatcher from pulling the whole repo into one summary
+    max_depth = max_depth or int(os.getenv("FLOW_MAX_DEPTH", 6))
+    max_nodes = max_nodes or int(os.getenv("FLOW_MAX_NODES", 40))
+    callees, called = call_graph(function_ids, calls)
+
+    flows = {}
+    for entry_point in sorted(callees):
+        if entry_point in called:
+            continue
+        visited = {entry_point}
+        members = []
+        frontier = [entry_point]
+        for _ in range(max_depth):
+            next_frontier = []
+            for node_id in frontier:
+                for callee in callees.get(node_id, []):
+                    if callee in visited or len(members) >= max_nodes:
+                        continue
+                    visited.add(callee)
+                    members.append(callee)
+                    next_frontier.append(callee)
+            frontier = next_frontier
+            if not frontier or len(members) >= max_nodes:
+                break
+        flows[entry_point] = members
+    return flows
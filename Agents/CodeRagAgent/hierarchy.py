@@ -0,0 +1,97 @@
+import os
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+CONTAINER_TYPES = ("CLASS", "INTERFACE")
+
+# Lines of a file kept above its definitions (package, imports, module constants)
+FILE_HEADER_MAX_LINES = 40
+SIGNATURE_MAX_CHARS = 200
+
+
+def hierarchical_docstrings_enabled() -> bool:
+    return os.getenv("HIERARCHICAL_DOCSTRINGS", "0") == "1"
+
+
+def _line(node: Dict, key: str) -> int:
+    value = node.get(key)
+    return value if isinstance(value, int) else -1
+
+
+def containment(nodes: List[Dict]) -> Dict[str, List[str]]:
+    """Parent node_id -> child node_ids, ordered by line: the innermost enclosing class/interface, else the FILE."""
+    by_file = defaultdict(list)
+    for node in nodes:
+        by_file[node.get("file_path") or ""].append(node)
+
+    children = defaultdict(list)
+    for file_nodes in by_file.values():
+        files = [node for node in file_nodes if node.get("type") == "FILE"]
+        containers = sorted(
+            (node for node in file_nodes if node.get("type") in CONTAINER_TYPES),
+            key=lambda node: _line(node, "start_line"),
+        )
+        definitions = [node for node in file_nodes if node.get("type") != "FILE"]
+        for node in sorted(definitions, key=lambda node: _line(node, "start_line")):
+            start = _line(node, "start_line")
+            parent = None
+            for container in containers:
+                container_start, container_end = _line(container, "start_line"), _line(container, "end_line")
+                if container is node or container_start > start:
+                    continue
+                if container_end > container_start:
+                    if start <= container_end:
+                        parent = container
+                # Tags often carry no real end line: a function then goes to the closest class above
+                # it, while a class stays top level
+                elif node.get("type") == "FUNCTION":
+                    parent = container
+            if parent is None and files:
+                parent = files[0]
+            if parent is not None:
+                children[parent["node_id"]].append(node["node_id"])
+    return dict(children)
+
+
+def summary_levels(nodes: List[Dict], children: Dict[str, List[str]]) -> Dict[str, int]:
+    """Height of every node in the containment tree: leaves are 0, parents one above their highest child."""
+    levels = {}
+    for node in nodes:
+        stack = [(node["node_id"], False)]
+        while stack:
+            node_id, children_done = stack.pop()
+            if node_id in levels:
+                continue
+            if children_done:
+                levels[node_id] = 1 + max((levels.get(child, 0) for child in children.get(node_id, [])), default=-1)
+                continue
+            stack.append((node_id, True))
+            stack.extend((child, False) for child in children.get(node_id, []) if child not in levels)
+    return levels
+
+
+def signature(text: Optional[str], fallback: str) -> str:
+    """Declaration of a definition: its text up to the opening brace or colon, on one line."""
+    lines = [line.strip() for line in (text or "").splitlines() if line.strip()]
+    head = " ".join(lines[:5])
+    head = re.split(r"\{|:\s*$", head, maxsplit=1)[0].strip()
+    head = re.sub(r"\s+", " ", head)
+    return (head or fallback)[:SIGNATURE_MAX_CHARS]
+
+
+def skeleton_text(node: Dict, child_nodes: List[Dict], docstrings: Dict[str, Optional[str]]) -> str:
+    """Stand-in for a container's code: its declaration (or a file's header) plus one summarized line per child."""
+    text = node.get("text") or ""
+    if node.get("type") == "FILE":
+        first_child_line = min((_line(child, "start_line") for child in child_nodes), default=-1)
+        header_lines = text.splitlines()[: max(first_child_line, 0)][:FILE_HEADER_MAX_LINES]
+        header = "\n".join(line for line in header_lines if line.strip())
+        opening, closing, indent = (header + "\n" if header else ""), "", ""
+    else:
+        opening, closing, indent = signature(text, node.get("name") or "") + " {\n", "}", "    "
+    members = []
+    for child in child_nodes:
+        docstring = docstrings.get(child["node_id"]) or "(no summary)"
+        members.append(f"{indent}{signature(child.get('text'), child.get('name') or '')}  // {docstring}")
+    return opening + "\n".join(members) + ("\n" + closing if closing else "")
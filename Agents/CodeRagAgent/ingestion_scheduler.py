@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+from Agents.CodeRagAgent.graph import RepoMap
+from Agents.CodeRagAgent.priority import recent_files_from_git
+from Agents.CodeRagAgent.utils import SimpleIO, SimpleTokenCounter
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionJob(NamedTuple):
+    repo_id: str
+    repo_dir: str
+    full_rebuild: bool = False
+    source_subdir: Optional[str] = None
+
+
+class IngestionResult(NamedTuple):
+    repo_id: str
+    touched_nodes: Optional[int]  # None after a full rebuild
+    seconds: float
+    error: Optional[str] = None
+
+
+def parse_repository(repo_dir: str, source_subdir: Optional[str] = None):
+    """Builds the code graph of one checkout (runs in a worker process)."""
+    repo_map = RepoMap(root=repo_dir, verbose=True, main_model=SimpleTokenCounter(), io=SimpleIO())
+    return repo_map.create_graph(repo_dir, source_subdir)
+
+
+class IngestionScheduler:
+    """Ingests many repositories concurrently, each under its own repoId; a failing repo does not stop the others."""
+
+    def __init__(self, service=None, max_concurrent_repos: int = None, parse_workers: int = None):
+        if service is None:
+            from Agents.CodeRagAgent.service import get_inference_service
+
+            service = get_inference_service()
+        self.service = service
+        self.max_concurrent_repos = max_concurrent_repos or int(os.getenv("INGEST_MAX_REPOS", 4))
+        self.parse_workers = parse_workers or int(os.getenv("INGEST_PARSE_WORKERS", os.cpu_count() or 1))
+
+    def run(self, jobs: List[IngestionJob]) -> Dict[str, IngestionResult]:
+        return asyncio.run(self.arun(jobs))
+
+    async def arun(self, jobs: List[IngestionJob]) -> Dict[str, IngestionResult]:
+        repo_ids = [job.repo_id for job in jobs]
+        if len(set(repo_ids)) != len(repo_ids):
+            raise ValueError(f"Duplicate repo ids in ingestion jobs: {repo_ids}")
+        # Jobs share the parse pool, the service's LLM buckets and its Neo4j write slots,
+        # so more repos raise throughput without overrunning any of them
+        slots = asyncio.Semaphore(self.max_concurrent_repos)
+        started_at = time.monotonic()
+        with ProcessPoolExecutor(max_workers=self.parse_workers) as parse_pool:
+            results = await asyncio.gather(*(self._run_job(job, slots, parse_pool) for job in jobs))
+        await self.service.aclose()
+        failed = [result for result in results if result.error]
+        print(
+            f"Ingested {len(results) - len(failed)}/{len(results)} repositories "
+            f"in {time.monotonic() - started_at:.1f}s"
+        )
+        for result in failed:
+            print(f"  {result.repo_id} failed: {result.error}")
+        return {result.repo_id: result for result in results}
+
+    async def _run_job(self, job: IngestionJob, slots: asyncio.Semaphore, parse_pool) -> IngestionResult:
+        async with slots:
+            started_at = time.monotonic()
+            print(f"Ingesting {job.repo_id} from {job.repo_dir}")
+            try:
+                nx_graph = await asyncio.get_running_loop().run_in_executor(
+                    parse_pool, parse_repository, job.repo_dir, job.source_subdir
+                )
+                recent_files = await asyncio.to_thread(recent_files_from_git, job.repo_dir)
+                touched_nodes = await self.service.aingest_repository(
+                    nx_graph, job.repo_id, job.full_rebuild, recent_files
+                )
+            except Exception as e:
+                logger.exception(f"Ingestion of {job.repo_id} failed")
+                return IngestionResult(job.repo_id, None, time.monotonic() - started_at, error=str(e))
+            seconds = time.monotonic() - started_at
+            print(f"Finished {job.repo_id} in {seconds:.1f}s")
+            return IngestionResult(
+                job.repo_id, len(touched_nodes) if touched_nodes is not None else None, seconds
+            )
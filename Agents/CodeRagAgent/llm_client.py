@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Type
+import google.generativeai as genai
+import instructor
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """True if the error, or anything it wraps, is an HTTP 429 / quota error."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+            return True
+        message = str(error).lower()
+        if "429" in message or "resource exhausted" in message or "resource_exhausted" in message:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def retry_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate_per_minute``."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        # A thread lock, not an asyncio one, so every event loop and thread can share the bucket
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1):
+        # Requests larger than the bucket would never fit; let them through once it is full
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits applied together."""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    async def acquire(self, tokens: int):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(tokens)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD concurrency limit: halved on throttling, grown by one after a full window of successes."""
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = max_limit
+        self.in_flight = 0
+        self._successes = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        while True:
+            with self._lock:
+                if self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                loop = asyncio.get_running_loop()
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._lock:
+                    self._wake()
+                raise
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def on_success(self):
+        with self._lock:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._wake()
+
+    def on_throttle(self):
+        with self._lock:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self._successes = 0
+        logger.warning(f"LLM throttled, concurrency limit reduced to {self.limit}")
+
+    def _wake(self):
+        free = self.limit - self.in_flight
+        while free > 0 and self._waiters:
+            loop, waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            loop.call_soon_threadsafe(_resolve_waiter, waiter)
+            free -= 1
+
+
+def _resolve_waiter(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class LLMClient:
+    """Structured-output Gemini client shared by all docstring requests, paced by RPM/TPM buckets."""
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_MODEL,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        max_retries: int = 6,
+    ):
+        self.model_name = model_name
+        self.max_retries = max_retries
+        rpm = rpm or float(os.getenv("LLM_RPM", 2000))
+        tpm = tpm or float(os.getenv("LLM_TPM", 4000000))
+        max_concurrency = max_concurrency or int(
+            os.getenv("LLM_MAX_CONCURRENCY", os.getenv("PARALLEL_REQUESTS", 50))
+        )
+        self.rate_limiter = RateLimiter(rpm, tpm)
+        self.concurrency = AdaptiveConcurrencyLimiter(max_concurrency)
+        # The instructor client is blocking; its own pool lets concurrent create calls overlap
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self.client = instructor.from_gemini(
+            client=genai.GenerativeModel(model_name=f"models/{model_name}"),
+            mode=instructor.Mode.GEMINI_JSON,
+        )
+
+    async def create(
+        self,
+        messages: List[Dict[str, str]],
+        response_model: Type[BaseModel],
+        estimated_tokens: int = 1,
+    ) -> BaseModel:
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire(estimated_tokens)
+            await self.concurrency.acquire()
+            try:
+                response = await loop.run_in_executor(
+                    self.executor,
+                    lambda: self.client.chat.completions.create(
+                        messages=messages,
+                        response_model=response_model,
+                    ),
+                )
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                self.concurrency.on_throttle()
+                delay = retry_delay(attempt + 1)
+                logger.warning(f"LLM rate limited (attempt {attempt + 1}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                self.concurrency.release()
+            self.concurrency.on_success()
+            return response
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Collection, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from Agents.CodeRagAgent.vector_search import exact_top_k_many, safe_file_name
+
+logger = logging.getLogger(__name__)
+
+try:
+    import hnswlib
+except ImportError:  # optional, the exact backend needs only numpy
+    hnswlib = None
+
+
+def local_index_enabled() -> bool:
+    return os.getenv("LOCAL_VECTOR_INDEX", "0") == "1"
+
+
+class LocalVectorIndex:
+    """In-process mirror of one repo's ``n.embedding`` vectors, persisted as ``vectors.npy`` and ``ids.json``."""
+
+    def __init__(self, repo_id: str, dim: int = 384, directory: Optional[str] = None, backend: Optional[str] = None):
+        self.repo_id = repo_id
+        self.dim = dim
+        self.backend = backend or os.getenv("LOCAL_INDEX_BACKEND", "exact")
+        if self.backend == "hnsw" and hnswlib is None:
+            logger.warning("hnswlib is not installed, using the exact local index")
+            self.backend = "exact"
+        base_directory = directory or os.getenv("LOCAL_INDEX_DIR", os.path.join(".cache", "vector_index"))
+        self.directory = os.path.join(base_directory, safe_file_name(repo_id))
+        self.vectors_path = os.path.join(self.directory, "vectors.npy")
+        self.ids_path = os.path.join(self.directory, "ids.json")
+        self._lock = threading.RLock()
+        self.node_ids: List[Optional[str]] = []
+        self.rows: Dict[str, int] = {}
+        # Grown by doubling so incremental upserts do not copy the whole matrix each time
+        self._buffer = np.zeros((0, dim), dtype=np.float32)
+        self._hnsw = None
+        # mtime of the files this instance last loaded or wrote, to notice saves by other processes
+        self._file_mtime = None
+        self._saved_at = time.monotonic()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._buffer[: len(self.node_ids)]
+
+    def _ensure_capacity(self, size: int):
+        if size > len(self._buffer):
+            buffer = np.zeros((max(size, 2 * len(self._buffer), 1024), self.dim), dtype=np.float32)
+            buffer[: len(self.node_ids)] = self.vectors
+            self._buffer = buffer
+
+    def _mtime(self) -> Optional[int]:
+        try:
+            return max(os.stat(self.vectors_path).st_mtime_ns, os.stat(self.ids_path).st_mtime_ns)
+        except OSError:
+            return None
+
+    def _load(self):
+        if not (os.path.exists(self.vectors_path) and os.path.exists(self.ids_path)):
+            return
+        mtime = self._mtime()
+        with open(self.ids_path, "r", encoding="utf-8") as f:
+            node_ids = json.load(f)
+        vectors = np.load(self.vectors_path)
+        if vectors.shape != (len(node_ids), self.dim):
+            # Possibly caught between the two file replacements of a save; retried on the next reload
+            logger.warning(f"Local vector index for {self.repo_id} is inconsistent, ignoring it")
+            return
+        self.node_ids = node_ids
+        self._buffer = vectors.astype(np.float32, copy=False)
+        self.rows = {node_id: row for row, node_id in enumerate(node_ids) if node_id is not None}
+        self._hnsw = None
+        self._file_mtime = mtime
+
+    @property
+    def state(self):
+        """Changes whenever the index gains or loses nodes, here or through a reload."""
+        return self._file_mtime, len(self.rows)
+
+    def reload_if_changed(self):
+        """Picks up a save made by another process (e.g. an ingestion run)."""
+        with self._lock:
+            mtime = self._mtime()
+            if mtime is not None and mtime != self._file_mtime:
+                self._load()
+
+    def save(self):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            live = [row for row, node_id in enumerate(self.node_ids) if node_id is not None]
+            # Saving also drops the slots of removed nodes
+            if len(live) != len(self.node_ids):
+                self._buffer = self.vectors[live]
+                self.node_ids = [self.node_ids[row] for row in live]
+                self.rows = {node_id: row for row, node_id in enumerate(self.node_ids)}
+                self._hnsw = None
+            with open(self.vectors_path + ".tmp", "wb") as f:
+                np.save(f, self.vectors)
+            with open(self.ids_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.node_ids, f)
+            os.replace(self.vectors_path + ".tmp", self.vectors_path)
+            os.replace(self.ids_path + ".tmp", self.ids_path)
+            self._file_mtime = self._mtime()
+            self._saved_at = time.monotonic()
+
+    def save_if_due(self, interval: float = None):
+        """Saves at most every ``interval`` seconds (LOCAL_INDEX_SAVE_INTERVAL), for saves after each batch."""
+        interval = interval if interval is not None else float(os.getenv("LOCAL_INDEX_SAVE_INTERVAL", 30))
+        if time.monotonic() - self._saved_at >= interval:
+            self.save()
+
+    def upsert(self, node_ids: Sequence[str], vectors, save: bool = False):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(node_ids), self.dim)
+        vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        with self._lock:
+            new_ids, new_vectors = [], []
+            for node_id, vector in zip(node_ids, vectors):
+                row = self.rows.get(node_id)
+                if row is None:
+                    self.rows[node_id] = len(self.node_ids) + len(new_ids)
+                    new_ids.append(node_id)
+                    new_vectors.append(vector)
+                else:
+                    self._buffer[row] = vector
+                    if self._hnsw is not None:
+                        self._hnsw.add_items(vector[None, :], [row], replace_deleted=False)
+            if new_ids:
+                first_row = len(self.node_ids)
+                self._ensure_capacity(first_row + len(new_ids))
+                self._buffer[first_row : first_row + len(new_ids)] = new_vectors
+                self.node_ids.extend(new_ids)
+                if self._hnsw is not None:
+                    if len(self.node_ids) > self._hnsw.get_max_elements():
+                        self._hnsw.resize_index(max(len(self.node_ids), 2 * self._hnsw.get_max_elements()))
+                    self._hnsw.add_items(self.vectors[first_row:], list(range(first_row, len(self.node_ids))))
+            if save:
+                self.save()
+
+    def remove(self, node_ids: Collection[str], save: bool = False):
+        with self._lock:
+            for node_id in node_ids:
+                row = self.rows.pop(node_id, None)
+                if row is None:
+                    continue
+                self.node_ids[row] = None
+                if self._hnsw is not None:
+                    self._hnsw.mark_deleted(row)
+            if save:
+                self.save()
+
+    def clear(self):
+        with self._lock:
+            self.node_ids, self.rows, self._hnsw = [], {}, None
+            self._buffer = np.zeros((0, self.dim), dtype=np.float32)
+            for path in (self.vectors_path, self.ids_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._file_mtime = None
+
+    def _hnsw_index(self):
+        if self._hnsw is None:
+            index = hnswlib.Index(space="cosine", dim=self.dim)
+            index.init_index(max_elements=max(len(self.node_ids), 1), ef_construction=200, M=16)
+            live = [row for row, node_id in enumerate(self.node_ids) if node_id is not None]
+            if live:
+                index.add_items(self.vectors[live], live)
+            index.set_ef(int(os.getenv("LOCAL_INDEX_EF", 64)))
+            self._hnsw = index
+        return self._hnsw
+
+    def search(
+        self, query, top_k: int, allowed: Optional[Collection[str]] = None
+    ) -> List[Tuple[str, float]]:
+        return self.search_many(np.asarray(query, dtype=np.float32)[None, :], top_k, allowed)[0]
+
+    def search_many(
+        self, queries, top_k: int, allowed: Optional[Collection[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """Best ``top_k`` (node_id, score) pairs per query row, optionally only among ``allowed`` ids."""
+        # Scores use the (1 + cos) / 2 scale of Neo4j's cosine index; "hnsw" searches an hnswlib graph
+        # built over the same vectors, "exact" a NumPy matrix product
+        queries = np.asarray(queries, dtype=np.float32)
+        queries = queries / np.clip(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12, None)
+        with self._lock:
+            if not self.rows:
+                return [[] for _ in range(len(queries))]
+            if self.backend == "hnsw":
+                return self._search_hnsw(queries, top_k, allowed)
+            if allowed is None and len(self.rows) == len(self.node_ids):
+                rows = np.arange(len(self.node_ids))
+            elif allowed is None:
+                rows = np.fromiter(self.rows.values(), dtype=np.int64, count=len(self.rows))
+            else:
+                rows = np.array([self.rows[node_id] for node_id in allowed if node_id in self.rows], dtype=np.int64)
+            return self._search_rows(queries, top_k, rows)
+
+    def _search_rows(self, queries, top_k: int, rows: np.ndarray) -> List[List[Tuple[str, float]]]:
+        """Exact scores of the normalized ``queries`` against the given rows."""
+        if len(rows) == len(self.node_ids):
+            return exact_top_k_many(queries, self.node_ids, self.vectors, top_k, normalized=True)
+        return exact_top_k_many(
+            queries, [self.node_ids[row] for row in rows], self.vectors[rows], top_k, normalized=True
+        )
+
+    def _search_hnsw(self, queries, top_k: int, allowed) -> List[List[Tuple[str, float]]]:
+        index = self._hnsw_index()
+        allowed_rows = None if allowed is None else {self.rows[n] for n in allowed if n in self.rows}
+        if allowed_rows is not None and not allowed_rows:
+            return [[] for _ in range(len(queries))]
+        k = min(top_k, len(self.rows) if allowed_rows is None else len(allowed_rows))
+        try:
+            labels, distances = index.knn_query(
+                queries, k=k, filter=None if allowed_rows is None else allowed_rows.__contains__
+            )
+        except RuntimeError:
+            # hnswlib gives up when the filtered graph search reaches fewer than k elements
+            # (small neighbourhoods); those are cheap to score exactly
+            return self._search_rows(queries, top_k, np.array(sorted(allowed_rows or self.rows.values()), dtype=np.int64))
+        # hnswlib's cosine distance is 1 - cos
+        return [
+            [(self.node_ids[label], float(1 - distance / 2)) for label, distance in zip(row_labels, row_distances)]
+            for row_labels, row_distances in zip(labels, distances)
+        ]
@@ -0,0 +1,99 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Sequence, Set
+
+DIRECTIONS = {
+    "out": "(n)-[r]->(m:NODE)",
+    "in": "(n)<-[r]-(m:NODE)",
+    "both": "(n)-[r]-(m:NODE)",
+}
+
+
+class NeighbourhoodExpander:
+    """Bounded breadth-first expansion of a node set, one Cypher round trip per hop."""
+
+    def __init__(
+        self,
+        max_hops: int = None,
+        fanout: int = None,
+        max_nodes: int = None,
+        rel_types: Optional[Sequence[str]] = None,
+        direction: str = None,
+        cache_size: int = 256,
+    ):
+        # The fan-out and size caps keep hub nodes from blowing the result up
+        self.max_hops = max_hops or int(os.getenv("NEIGHBOUR_MAX_HOPS", 4))
+        self.fanout = fanout or int(os.getenv("NEIGHBOUR_FANOUT", 25))
+        self.max_nodes = max_nodes or int(os.getenv("NEIGHBOUR_MAX_NODES", 2000))
+        self.rel_types = list(rel_types or os.getenv("NEIGHBOUR_REL_TYPES", "CONTAINS,REFERENCES").split(","))
+        self.direction = direction or os.getenv("NEIGHBOUR_DIRECTION", "both")
+        if self.direction not in DIRECTIONS:
+            raise ValueError(f"Unknown direction {self.direction}, expected one of {list(DIRECTIONS)}")
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._hop_query = f"""
+        UNWIND $frontier AS frontier_id
+        MATCH (n:NODE {{repoId: $repo_id, node_id: frontier_id}})
+        CALL {{
+            WITH n
+            MATCH {DIRECTIONS[self.direction]}
+            WHERE m.repoId = $repo_id AND type(r) IN $rel_types
+            RETURN DISTINCT m.node_id AS neighbour_id
+            LIMIT $fanout
+        }}
+        RETURN COLLECT(DISTINCT neighbour_id) AS neighbour_ids
+        """
+
+    def _cache_get(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    async def expand(
+        self, session, repo_id: str, node_ids: Iterable[str], graph_version: Optional[str]
+    ) -> Set[str]:
+        """Returns the start nodes plus every node reached within the hop, fan-out and size limits."""
+        # Cached per graph version, which writers bump; without one freshness is unknown
+        start = frozenset(node_ids)
+        key = (start, repo_id, graph_version)
+        cached = self._cache_get(key) if graph_version is not None else None
+        if cached is not None:
+            return cached
+
+        visited = set(start)
+        frontier: List[str] = sorted(start)
+        for _ in range(self.max_hops):
+            if not frontier or len(visited) >= self.max_nodes:
+                break
+            result = await session.run(
+                self._hop_query,
+                frontier=frontier,
+                repo_id=repo_id,
+                rel_types=self.rel_types,
+                fanout=self.fanout,
+            )
+            record = await result.single()
+            frontier = []
+            for neighbour_id in record["neighbour_ids"] if record else []:
+                if neighbour_id in visited:
+                    continue
+                if len(visited) >= self.max_nodes:
+                    break
+                visited.add(neighbour_id)
+                frontier.append(neighbour_id)
+
+        context = frozenset(visited)
+        if graph_version is not None:
+            self._cache_put(key, context)
+        return context
@@ -0,0 +1,95 @@
+import logging
+import os
+import subprocess
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import networkx as nx
+from Agents.CodeRagAgent.flows import entry_points
+
+logger = logging.getLogger(__name__)
+
+ENTRY_POINT_WEIGHT = 2.0
+RECENT_FILE_WEIGHT = 1.0
+
+
+def priority_enabled() -> bool:
+    return os.getenv("DOCSTRING_PRIORITY", "1") == "1"
+
+
+def priority_tier_size() -> int:
+    return int(os.getenv("DOCSTRING_PRIORITY_TIER", 500))
+
+
+def recent_files_from_git(repo_dir: str, max_commits: int = None) -> List[str]:
+    """Files touched by the last ``max_commits`` commits of ``repo_dir``, most recent first."""
+    max_commits = max_commits or int(os.getenv("PRIORITY_RECENT_COMMITS", 50))
+    try:
+        output = subprocess.run(
+            ["git", "-C", repo_dir, "log", f"-n{max_commits}", "--name-only", "--pretty=format:"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.info(f"No git history for {repo_dir}: {e}")
+        return []
+    files = []
+    for line in output.splitlines():
+        line = line.strip()
+        if line and line not in files:
+            files.append(line)
+    return files
+
+
+def node_priorities(
+    nodes: Sequence[Dict],
+    references: Iterable[Tuple[str, str]],
+    recent_files: Optional[Sequence[str]] = None,
+) -> Dict[str, float]:
+    """Scores nodes as 2 * is_entry_point + PageRank percentile + file recency; higher is documented first."""
+    # recent_files are repo-relative, so they are matched on path suffix.
+    references = list(references)
+    node_ids = [node["node_id"] for node in nodes]
+    functions = [node["node_id"] for node in nodes if node.get("type") == "FUNCTION"]
+    entries = set(entry_points(functions, references))
+
+    graph = nx.DiGraph()
+    graph.add_nodes_from(node_ids)
+    graph.add_edges_from((source, target) for source, target in references if source in graph and target in graph)
+    try:
+        ranks = nx.pagerank(graph) if graph.number_of_edges() else {}
+    except Exception as e:  # pagerank can fail to converge on odd graphs
+        logger.warning(f"PageRank failed, ignoring centrality: {e}")
+        ranks = {}
+    ordered = sorted(node_ids, key=lambda node_id: ranks.get(node_id, 0.0))
+    percentiles = {node_id: index / max(len(ordered) - 1, 1) for index, node_id in enumerate(ordered)} if ranks else {}
+
+    recency = {}
+    recent_files = list(recent_files or [])
+    for index, path in enumerate(recent_files):
+        parts = path.replace("\\", "/").split("/")
+        for start in range(len(parts)):
+            recency.setdefault("/".join(parts[start:]), 1 - index / len(recent_files))
+
+    priorities = {}
+    for node in nodes:
+        node_id = node["node_id"]
+        file_path = (node.get("file_path") or "").replace("\\", "/")
+        priorities[node_id] = (
+            ENTRY_POINT_WEIGHT * (node_id in entries)
+            + percentiles.get(node_id, 0.0)
+            + RECENT_FILE_WEIGHT * recency.get(file_path, 0.0)
+        )
+    return priorities
+
+
+def priority_tiers(texts: Dict[str, str], priorities: Optional[Dict[str, float]], tier_size: int = None) -> List[Dict[str, str]]:
+    """Splits ``texts`` into chunks of ``tier_size`` nodes, highest priority first."""
+    # Tiers are batched separately, so bin packing moves a node by at most one tier.
+    if not priorities:
+        return [texts] if texts else []
+    tier_size = tier_size or priority_tier_size()
+    ordered = sorted(texts, key=lambda node_id: priorities.get(node_id, 0.0), reverse=True)
+    return [
+        {node_id: texts[node_id] for node_id in ordered[i : i + tier_size]}
+        for i in range(0, len(ordered), tier_size)
+    ]
@@ -0,0 +1,42 @@
+import threading
+import time
+from typing import Dict, Optional
+
+
+class DocstringProgress:
+    """Counts documented nodes of one repo's docstring run, for ``get_progress``."""
+
+    def __init__(self, repo_id: str, total: int):
+        self.repo_id = repo_id
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.phase = "docstrings"
+        self.started_at = time.time()
+        self.persisted_at = 0.0
+        self._lock = threading.Lock()
+
+    def advance(self, count: int = 1):
+        with self._lock:
+            self.done = min(self.done + count, self.total)
+
+    def fail(self, count: int):
+        with self._lock:
+            self.failed += count
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            elapsed = time.time() - self.started_at
+            eta: Optional[float] = None
+            if 0 < self.done < self.total:
+                eta = elapsed / self.done * (self.total - self.done)
+            return {
+                "repo_id": self.repo_id,
+                "phase": self.phase,
+                "total": self.total,
+                "done": self.done,
+                "failed": self.failed,
+                "percent": round(100 * self.done / self.total, 1) if self.total else 100.0,
+                "elapsed_seconds": round(elapsed, 1),
+                "eta_seconds": round(eta, 1) if eta is not None else None,
+            }
@@ -0,0 +1,138 @@
+import atexit
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+
+class ResourceRegistry:
+    """Process-wide shared resources (drivers, model clients, caches), built on first ``get``."""
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._closers: Dict[str, Optional[Callable[[Any], None]]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+
+    def register(self, name: str, factory: Callable[[], Any], close: Optional[Callable[[Any], None]] = None):
+        with self._lock:
+            self._factories[name] = factory
+            self._closers[name] = close
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            if name not in self._instances:
+                if name not in self._factories:
+                    raise KeyError(f"Unknown resource: {name}")
+                logger.info(f"Loading shared resource {name}")
+                self._instances[name] = self._factories[name]()
+            return self._instances[name]
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def warm_up(self, names: Optional[Iterable[str]] = None):
+        for name in names if names is not None else list(self._factories):
+            self.get(name)
+
+    def release(self, name: str):
+        """Closes one resource; the next ``get`` creates it again."""
+        with self._lock:
+            instance = self._instances.pop(name, None)
+            close = self._closers.get(name)
+        if instance is not None and close is not None:
+            try:
+                close(instance)
+            except Exception as e:
+                logger.warning(f"Failed to close resource {name}: {e}")
+
+    def shutdown(self):
+        # Reverse creation order, so dependants close before what they use
+        for name in reversed(list(self._instances)):
+            self.release(name)
+
+
+def neo4j_driver_config() -> Dict[str, Any]:
+    """Connection pool settings shared by the sync and async Neo4j drivers."""
+    return {
+        "max_connection_pool_size": int(os.getenv("NEO4J_MAX_POOL_SIZE", 100)),
+        "max_connection_lifetime": float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", 3600)),
+        "connection_acquisition_timeout": float(os.getenv("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", 60)),
+    }
+
+
+def _neo4j_driver():
+    from neo4j import GraphDatabase
+
+    return GraphDatabase.driver(
+        os.environ["neo4j_uri"],
+        auth=(os.environ["neo4j_username"], os.environ["neo4j_password"]),
+        **neo4j_driver_config(),
+    )
+
+
+def _chat_llm():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=os.environ["GOOGLE_API_KEY"])
+
+
+def _llm_client():
+    import google.generativeai as genai
+    from Agents.CodeRagAgent.llm_client import LLMClient
+
+    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+    return LLMClient()
+
+
+def _embedding_backend():
+    from Agents.CodeRagAgent.embedding_backends import create_embedding_backend
+
+    # EMBEDDING_BACKEND=onnx|onnx-int8 serves the same model through ONNX Runtime on CPU
+    return create_embedding_backend(EMBEDDING_MODEL_NAME)
+
+
+def _embeddings():
+    from Agents.CodeRagAgent.embedding_store import EmbeddingStore
+    from Agents.CodeRagAgent.embeddings import EmbeddingService
+
+    backend = registry.get("embedding_backend")
+    store = None
+    if os.getenv("EMBEDDING_CACHE", "1") != "0":
+        store = EmbeddingStore(
+            f"{EMBEDDING_MODEL_NAME}-{backend.name}", dim=backend.get_sentence_embedding_dimension()
+        )
+    return EmbeddingService(backend, store=store)
+
+
+def _docstring_cache():
+    from Agents.CodeRagAgent.docstring_cache import DocstringCache
+
+    return DocstringCache()
+
+
+def _token_counter():
+    from Agents.CodeRagAgent.token_counter import TokenCounter
+
+    return TokenCounter()
+
+
+registry = ResourceRegistry()
+registry.register("neo4j_driver", _neo4j_driver, lambda driver: driver.close())
+registry.register("chat_llm", _chat_llm)
+registry.register("llm_client", _llm_client, lambda client: client.close())
+registry.register("embedding_backend", _embedding_backend)
+registry.register("embeddings", _embeddings, lambda embeddings: embeddings.close())
+registry.register("docstring_cache", _docstring_cache, lambda cache: cache.close())
+registry.register("token_counter", _token_counter)
+atexit.register(registry.shutdown)
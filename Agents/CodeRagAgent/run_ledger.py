@@ -0,0 +1,43 @@
+import os
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+from Agents.CodeRagAgent.vector_search import safe_file_name
+
+
+class RunLedger:
+    """Append-only ``<node_id> <content_hash>`` record of documented nodes, so a crashed run can resume."""
+
+    def __init__(self, repo_id: str = "default", directory: Optional[str] = None):
+        self.directory = directory or os.getenv("RUN_LEDGER_DIR", os.path.join(".cache", "ledgers"))
+        self.path = os.path.join(self.directory, f"{safe_file_name(repo_id)}.ledger")
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, str]:
+        """Returns node_id -> content hash for every node recorded as completed."""
+        completed = {}
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                # A torn last line from a crash is simply ignored
+                if len(parts) == 2:
+                    completed[parts[0]] = parts[1]
+        return completed
+
+    def record(self, entries: Iterable[Tuple[str, str]]):
+        lines = "".join(f"{node_id} {content_hash}\n" for node_id, content_hash in entries)
+        if not lines:
+            return
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def clear(self):
+        # Called when a run completes or the repository graph is rebuilt
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
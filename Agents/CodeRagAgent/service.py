@@ -2,28 +2,85 @@ import asyncio
 import logging
 import os
 import re
+import time
+from collections import OrderedDict, defaultdict
 from typing import Dict, List, Optional
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-from neo4j import GraphDatabase
+from neo4j import AsyncGraphDatabase
 from pydantic import BaseModel
-import tiktoken
-from sentence_transformers import SentenceTransformer
-import google.generativeai as genai
 import os
-import instructor
+from Agents.CodeRagAgent.batch_planner import BatchPlan, BatchPlanner
+from Agents.CodeRagAgent.bulk_import import BulkImportExporter
+from Agents.CodeRagAgent.dedup import DuplicateGroups, dedup_enabled, group_duplicates, rename_docstring
+from Agents.CodeRagAgent.docstring_cache import DocstringCache
+from Agents.CodeRagAgent.flows import FLOW_PROMPT_VERSION, find_flows, flow_node_id, flows_enabled
 from Agents.CodeRagAgent.graph import RepoMap
-from Agents.CodeRagAgent.utils import SimpleTokenCounter, SimpleIO, visualize_graph, generate_node_id
+from Agents.CodeRagAgent.hierarchy import containment, hierarchical_docstrings_enabled, skeleton_text, summary_levels
+from Agents.CodeRagAgent.llm_client import AdaptiveConcurrencyLimiter, retry_delay
+from Agents.CodeRagAgent.local_index import LocalVectorIndex, local_index_enabled
+from Agents.CodeRagAgent.neighbourhood import NeighbourhoodExpander
+from Agents.CodeRagAgent.priority import (
+    node_priorities,
+    priority_enabled,
+    priority_tier_size,
+    priority_tiers,
+    recent_files_from_git,
+)
+from Agents.CodeRagAgent.progress import DocstringProgress
+from Agents.CodeRagAgent.resources import EMBEDDING_MODEL_NAME, neo4j_driver_config, registry
+from Agents.CodeRagAgent.run_ledger import RunLedger
+from Agents.CodeRagAgent.token_counter import TokenCounter
+from Agents.CodeRagAgent.vector_search import (
+    EXACT_SEARCH_MAX_NODES,
+    GLOBAL_VECTOR_INDEX,
+    VECTOR_SEARCH_MAX_K,
+    exact_top_k_many,
+    partition_by_repo,
+    repo_partition_label,
+    vector_index_name,
+)
+from Agents.CodeRagAgent.utils import BackgroundLoop, SimpleTokenCounter, SimpleIO, visualize_graph, generate_node_id
 import networkx as nx
+import numpy as np
 from grep_ast import filename_to_lang
 
 
 load_dotenv()
 
-genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
-
 logger = logging.getLogger(__name__)
 
+# Bump whenever the docstring prompt changes so cached docstrings are regenerated
+DOCSTRING_PROMPT_VERSION = "1"
+
+# Retries for nodes missing from (or failing in) an LLM response
+DOCSTRING_MAX_RETRIES = int(os.getenv("DOCSTRING_MAX_RETRIES", 4))
+RETRY_BATCH_SIZE = 5
+
+# Levels of window summaries for nodes larger than one request
+MAX_SUMMARY_LEVELS = 4
+
+# Node types that also get a label of their own
+NODE_TYPE_LABELS = ("FILE", "CLASS", "FUNCTION", "INTERFACE")
+
+# Node types with their own counter on the REPO_META node
+GRAPH_STAT_TYPES = ("FILE", "CLASS", "FUNCTION", "INTERFACE", "FLOW")
+GRAPH_STAT_KEYS = ("node_count", "relationship_count") + tuple(f"{t}_count" for t in GRAPH_STAT_TYPES)
+
+
+def graph_stat_keys():
+    # embedding_count (NODEs with an embedding) tells whether the local vector index is complete.
+    # It costs a REPO_META write per docstring batch, so it is only kept with LOCAL_VECTOR_INDEX=1
+    return GRAPH_STAT_KEYS + ("embedding_count",) if local_index_enabled() else GRAPH_STAT_KEYS
+
+# Seconds between progress writes to REPO_META while docstrings are generated
+PROGRESS_WRITE_INTERVAL = float(os.getenv("PROGRESS_WRITE_INTERVAL", 10))
+
+# Questions whose embeddings are kept for the session (agents tend to repeat them)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 256))
+
+REFERENCE_MARKER = "Code replaced for brevity"
+REFERENCE_PATTERN = re.compile(r"Code replaced for brevity\. See node_id ([a-f0-9]+)")
+
 class DocstringRequest(BaseModel):
     node_id: str
     text: str
@@ -41,72 +98,247 @@ class DocstringResponse(BaseModel):
 class InferenceService:
     
     def __init__(self):
-        neo4j_auth = (os.environ["neo4j_username"], os.environ["neo4j_password"])
-        self.driver=GraphDatabase.driver(os.environ["neo4j_uri"], auth=neo4j_auth)
-        self.llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=os.environ["GOOGLE_API_KEY"])
-        self.embedding_model = SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
+        self.neo4j_auth = (os.environ["neo4j_username"], os.environ["neo4j_password"])
+        self.embedding_model_name = EMBEDDING_MODEL_NAME
         self.parallel_requests = int(os.getenv("PARALLEL_REQUESTS", 50))
+        self.neighbourhood = NeighbourhoodExpander()
+        # Caps concurrent write transactions across every repo being ingested (fixed limit, never adapted)
+        self.db_writes = AdaptiveConcurrencyLimiter(int(os.getenv("NEO4J_WRITE_CONCURRENCY", 8)))
+        self._repo_meta_constraint = False
+        self._local_indexes = {}
+        self._query_embeddings = OrderedDict()
+        # repo_id -> (local index state, whether it held every embedded node in that state)
+        self._index_complete = {}
+        self._progress: Dict[str, DocstringProgress] = {}
+        # Async drivers are bound to the event loop they were created on
+        self._async_drivers = {}
+        # Sync methods are thin wrappers running the async ones on this loop
+        self._sync_loop = BackgroundLoop()
+
+    # Drivers, models and caches are shared process-wide and only loaded on first use
+    @property
+    def driver(self):
+        return registry.get("neo4j_driver")
+
+    @property
+    def llm(self):
+        return registry.get("chat_llm")
+
+    @property
+    def llm_client(self):
+        return registry.get("llm_client")
+
+    @property
+    def embedding_model(self):
+        return registry.get("embedding_backend")
+
+    @property
+    def embeddings(self):
+        return registry.get("embeddings")
+
+    @property
+    def docstring_cache(self):
+        return registry.get("docstring_cache")
+
+    @property
+    def token_counter(self):
+        return registry.get("token_counter")
+
+    def local_index(self, repo_id: str) -> Optional[LocalVectorIndex]:
+        """The repo's in-process vector index, or None unless LOCAL_VECTOR_INDEX=1."""
+        if not local_index_enabled():
+            return None
+        index = self._local_indexes.get(repo_id)
+        if index is None:
+            index = self._local_indexes[repo_id] = LocalVectorIndex(repo_id)
+        return index
+
+    async def abackfill_local_index(self, repo_id: str, node_ids):
+        """Adds embeddings stored in Neo4j that the local index is missing (e.g. after a crash before it was saved)."""
+        index = self.local_index(repo_id)
+        if index is None:
+            return
+        missing = [node_id for node_id in node_ids if node_id not in index.rows]
+        if not missing:
+            return
+        async with self.async_driver.session() as session:
+            result = await session.run(
+                """
+                UNWIND $node_ids AS id
+                MATCH (n:NODE {repoId: $repo_id, node_id: id})
+                WHERE n.embedding IS NOT NULL
+                RETURN n.node_id AS node_id, n.embedding AS embedding
+                """,
+                repo_id=repo_id,
+                node_ids=missing,
+            )
+            records = [record async for record in result]
+        if records:
+            index.upsert([r["node_id"] for r in records], [r["embedding"] for r in records], save=True)
+            print(f"Local vector index of {repo_id}: restored {len(records)} embeddings from Neo4j")
+
+    def rebuild_local_index(self, repo_id: str="default") -> int:
+        return self._run_sync(self.arebuild_local_index(repo_id))
+
+    async def arebuild_local_index(self, repo_id: str="default") -> int:
+        """Reloads the local index from the embeddings stored in Neo4j."""
+        index = self.local_index(repo_id)
+        if index is None:
+            return 0
+        async with self.async_driver.session() as session:
+            result = await session.run(
+                """
+                MATCH (n:NODE {repoId: $repo_id})
+                WHERE n.embedding IS NOT NULL
+                RETURN n.node_id AS node_id, n.embedding AS embedding
+                """,
+                repo_id=repo_id,
+            )
+            records = [record async for record in result]
+        index.clear()
+        if records:
+            index.upsert([r["node_id"] for r in records], [r["embedding"] for r in records])
+        index.save()
+        print(f"Local vector index for {repo_id} holds {len(index)} vectors")
+        return len(index)
+
+    @property
+    def async_driver(self):
+        loop = asyncio.get_running_loop()
+        driver = self._async_drivers.get(loop)
+        if driver is None:
+            # Drivers of loops that are gone (e.g. finished asyncio.run calls) can no longer be used
+            for closed_loop in [l for l in self._async_drivers if l.is_closed()]:
+                del self._async_drivers[closed_loop]
+            driver = AsyncGraphDatabase.driver(os.environ["neo4j_uri"], auth=self.neo4j_auth, **neo4j_driver_config())
+            self._async_drivers[loop] = driver
+        return driver
+
+    def _run_sync(self, coro):
+        return self._sync_loop.run(coro)
+
+    async def awrite(self, session, query: str, **params):
+        """Runs a write query to completion while holding one of the shared write slots."""
+        await self.db_writes.acquire()
+        try:
+            result = await session.run(query, **params)
+            return await result.consume()
+        finally:
+            self.db_writes.release()
 
-    def close(self):
-        self.driver.close()
-
-
-    def log_graph_stats(self, repo_id="default"):
-        query = """
-        MATCH (n:NODE {repoId: $repo_id})
-        OPTIONAL MATCH (n)-[r]-(m:NODE {repoId: $repo_id})
-        RETURN
-        COUNT(DISTINCT n) AS nodeCount,
-        COUNT(DISTINCT r) AS relationshipCount
-        """
+    async def aclose(self):
+        driver = self._async_drivers.pop(asyncio.get_running_loop(), None)
+        if driver is not None:
+            await driver.close()
 
+    def close(self):
+        """Closes this instance's async drivers; shared resources are closed by ``registry.shutdown()``."""
+        if self._sync_loop.loop is not None:
+            self._run_sync(self.aclose())
+            self._sync_loop.stop()
+
+    def log_graph_stats(self, repo_id="default", exact: Optional[bool]=None):
+        return self._run_sync(self.alog_graph_stats(repo_id, exact))
+
+    async def alog_graph_stats(self, repo_id="default", exact: Optional[bool]=None):
+        # Reads the counters kept by the writers; GRAPH_STATS_EXACT=1 recounts the graph instead
+        if exact is None:
+            exact = os.getenv("GRAPH_STATS_EXACT", "0") == "1"
         try:
-            # Establish connection
-            with self.driver.session() as session:
-                # Execute the query
-                result = session.run(query, repo_id=repo_id)
-                record = result.single()
-
-                if record:
-                    node_count = record["nodeCount"]
-                    relationship_count = record["relationshipCount"]
-
-                    # Log the results
-                    print(
-                        f"DEBUGNEO4J: Repo ID: {repo_id}, Nodes: {node_count}, Relationships: {relationship_count}"
-                    )
-                else:
-                    print(
-                        f"DEBUGNEO4J: No data found for repository ID: {repo_id}"
-                    )
-
+            stats = await self.aget_graph_stats(repo_id, exact)
+            print(
+                f"DEBUGNEO4J: Repo ID: {repo_id}, Nodes: {stats['nodes']}, Relationships: {stats['relationships']}"
+            )
         except Exception as e:
             logger.error(f"An error occurred: {str(e)}")
 
+    def get_graph_stats(self, repo_id="default", exact: bool=False) -> Dict:
+        return self._run_sync(self.aget_graph_stats(repo_id, exact))
+
+    async def aget_graph_stats(self, repo_id="default", exact: bool=False) -> Dict:
+        """Node and relationship counts of a repo, read from its REPO_META counters."""
+        # exact=True, or counters never initialized (graphs stored before they existed), recounts once
+        async with self.async_driver.session() as session:
+            if not exact:
+                result = await session.run(
+                    "MATCH (m:REPO_META {repoId: $repo_id}) RETURN m {.*} AS meta", repo_id=repo_id
+                )
+                record = await result.single()
+                if record and all(record["meta"].get(key) is not None for key in graph_stat_keys()):
+                    return self.format_graph_stats(repo_id, record["meta"])
+            return await self.arecount_graph_stats(session, repo_id)
+
+    async def arecount_graph_stats(self, session, repo_id: str) -> Dict:
+        result = await session.run(
+            "MATCH (n:NODE {repoId: $repo_id}) RETURN n.type AS type, count(*) AS count", repo_id=repo_id
+        )
+        type_counts = {record["type"]: record["count"] async for record in result}
+        embedding_count = None
+        if local_index_enabled():
+            result = await session.run(
+                "MATCH (n:NODE {repoId: $repo_id}) WHERE n.embedding IS NOT NULL RETURN count(n) AS count",
+                repo_id=repo_id,
+            )
+            embedding_count = (await result.single())["count"]
+        result = await session.run(
+            """
+            MATCH (:NODE {repoId: $repo_id})-[r]->(:NODE {repoId: $repo_id})
+            RETURN count(r) AS count
+            """,
+            repo_id=repo_id,
+        )
+        counts = {
+            "node_count": sum(type_counts.values()),
+            "relationship_count": (await result.single())["count"],
+            "embedding_count": embedding_count,
+            **{f"{node_type}_count": type_counts.get(node_type, 0) for node_type in GRAPH_STAT_TYPES},
+        }
+        await self.aensure_repo_meta(session)
+        result = await session.run(
+            """
+            MERGE (m:REPO_META {repoId: $repo_id})
+            ON CREATE SET m.graph_version = randomUUID()
+            SET m += $counts
+            RETURN m {.*} AS meta
+            """,
+            repo_id=repo_id,
+            counts=counts,
+        )
+        return self.format_graph_stats(repo_id, (await result.single())["meta"])
+
+    @staticmethod
+    def format_graph_stats(repo_id: str, meta: Dict) -> Dict:
+        return {
+            "repo_id": repo_id,
+            "nodes": meta["node_count"],
+            "relationships": meta["relationship_count"],
+            "embedded": meta.get("embedding_count"),
+            "nodes_by_type": {node_type: meta[f"{node_type}_count"] for node_type in GRAPH_STAT_TYPES},
+            "graph_version": meta.get("graph_version"),
+        }
+
     def num_tokens_from_string(self, string: str, model: str = "gpt-4") -> int:
         """Returns the number of tokens in a text string."""
-        try:
-            encoding = tiktoken.encoding_for_model(model)
-        except KeyError:
-            logger.warning("Warning: model not found. Using cl100k_base encoding.")
-            encoding = tiktoken.get_encoding("cl100k_base")
-        return len(encoding.encode(string, disallowed_special=set()))
+        return self.token_counter.count(string, model)
 
     def fetch_graph(self, repo_id: str) -> List[Dict]:
+        return self._run_sync(self.afetch_graph(repo_id))
+
+    async def afetch_graph(self, repo_id: str) -> List[Dict]:
         batch_size = 500
         all_nodes = []
-        with self.driver.session() as session:
+        async with self.async_driver.session() as session:
             offset = 0
             while True:
-                result = session.run(
-                    "MATCH (n:NODE {repoId: $repo_id}) "
-                    "RETURN n.node_id AS node_id, n.text AS text, n.file_path AS file_path, n.start_line AS start_line, n.end_line AS end_line, n.name AS name "
+                result = await session.run(
+                    "MATCH (n:NODE {repoId: $repo_id}) WHERE NOT n:FLOW "
+                    "RETURN n.node_id AS node_id, n.text AS text, n.file_path AS file_path, n.start_line AS start_line, n.end_line AS end_line, n.name AS name, n.type AS type "
                     "SKIP $offset LIMIT $limit",
                     repo_id=repo_id,
                     offset=offset,
                     limit=batch_size,
                 )
-                batch = [dict(record) for record in result]
+                batch = [dict(record) async for record in result]
                 if not batch:
                     break
                 all_nodes.extend(batch)
@@ -115,12 +347,15 @@ class InferenceService:
         return all_nodes
 
     def get_entry_points(self, repo_id: str) -> List[str]:
+        return self._run_sync(self.aget_entry_points(repo_id))
+
+    async def aget_entry_points(self, repo_id: str) -> List[str]:
         batch_size = 400  # Define the batch size
         all_entry_points = []
-        with self.driver.session() as session:
+        async with self.async_driver.session() as session:
             offset = 0
             while True:
-                result = session.run(
+                result = await session.run(
                     f"""
                     MATCH (f:FUNCTION)
                     WHERE f.repoId = '{repo_id}'
@@ -132,7 +367,7 @@ class InferenceService:
                     offset=offset,
                     limit=batch_size,
                 )
-                batch = result.data()
+                batch = await result.data()
                 if not batch:
                     break
                 all_entry_points.extend([record["node_id"] for record in batch])
@@ -140,12 +375,15 @@ class InferenceService:
         return all_entry_points
 
     def get_neighbours(self, node_id: str, repo_id: str):
-        with self.driver.session() as session:
+        return self._run_sync(self.aget_neighbours(node_id, repo_id))
+
+    async def aget_neighbours(self, node_id: str, repo_id: str):
+        async with self.async_driver.session() as session:
             batch_size = 400  # Define the batch size
             all_nodes_info = []
             offset = 0
             while True:
-                result = session.run(
+                result = await session.run(
                     """
                     MATCH (start {node_id: $node_id, repoId: $repo_id})
                     OPTIONAL MATCH (start)-[:CALLS]->(direct_neighbour)
@@ -162,7 +400,7 @@ class InferenceService:
                     offset=offset,
                     limit=batch_size,
                 )
-                batch = result.data()
+                batch = await result.data()
                 if not batch:
                     break
                 all_nodes_info.extend(
@@ -175,67 +413,85 @@ class InferenceService:
                 offset += batch_size
             return all_nodes_info
 
+    def expand_references(self, nodes: List[Dict]) -> Dict[str, str]:
+        """Returns node_id -> text with "Code replaced for brevity" references inlined."""
+        raw_texts = {node["node_id"]: node.get("text") or "" for node in nodes}
+        # Each referenced body is expanded once, dependencies first, and reused by every text including it
+        expanded_bodies = {}
+
+        def replace_match(match):
+            node_id = match.group(1)
+            if node_id in expanded_bodies:
+                return "\n" + expanded_bodies[node_id]
+            return match.group(0)
+
+        def expand_body(root_id: str):
+            # Iterative post-order DFS so deep reference chains can't hit the recursion limit
+            on_path = set()
+            stack = [(root_id, False)]
+            while stack:
+                node_id, dependencies_done = stack.pop()
+                if node_id in expanded_bodies:
+                    continue
+                body = raw_texts[node_id].split("\n", 1)[-1]
+                if dependencies_done:
+                    expanded_bodies[node_id] = REFERENCE_PATTERN.sub(replace_match, body)
+                    on_path.discard(node_id)
+                    continue
+                if node_id in on_path:
+                    continue  # Cycle: keep the reference unexpanded
+                on_path.add(node_id)
+                stack.append((node_id, True))
+                for ref_id in REFERENCE_PATTERN.findall(body):
+                    if ref_id in raw_texts and ref_id not in expanded_bodies and ref_id not in on_path:
+                        stack.append((ref_id, False))
+
+        texts = {}
+        for node in nodes:
+            text = node.get("text")
+            if not text:
+                continue
+            if REFERENCE_MARKER not in text:
+                texts[node["node_id"]] = text
+                continue
+            for ref_id in REFERENCE_PATTERN.findall(text):
+                if ref_id in raw_texts and ref_id not in expanded_bodies:
+                    expand_body(ref_id)
+            texts[node["node_id"]] = REFERENCE_PATTERN.sub(replace_match, text)
+        return texts
+
+    def plan_batches(
+        self, texts: Dict[str, str], max_tokens: int = 16000, model: str = "gpt-4"
+    ) -> BatchPlan:
+        planner = BatchPlanner(
+            lambda strings: self.token_counter.count_many(strings, model),
+            max_tokens=max_tokens,
+        )
+        return planner.plan(texts)
+
     def batch_nodes(
-        self, nodes: List[Dict], max_tokens: int = 16000, model: str = "gpt-4"
+        self,
+        nodes: List[Dict],
+        max_tokens: int = 16000,
+        model: str = "gpt-4",
+        texts: Optional[Dict[str, str]] = None,
     ) -> List[List[DocstringRequest]]:
-        batches = []
-        current_batch = []
-        current_tokens = 0
-        node_dict = {node["node_id"]: node for node in nodes}
-
-        def replace_referenced_text(
-            text: str, node_dict: Dict[str, Dict[str, str]]
-        ) -> str:
-            pattern = r"Code replaced for brevity\. See node_id ([a-f0-9]+)"
-            regex = re.compile(pattern)
-
-            def replace_match(match):
-                node_id = match.group(1)
-                if node_id in node_dict:
-                    return "\n" + node_dict[node_id]["text"].split("\n", 1)[-1]
-                return match.group(0)
-
-            previous_text = None
-            current_text = text
-
-            while previous_text != current_text:
-                previous_text = current_text
-                current_text = regex.sub(replace_match, current_text)
-            return current_text
+        if texts is None:
+            texts = self.expand_references(nodes)
 
         for node in nodes:
             if not node.get("text"):
                 logger.warning(f"Node {node['node_id']} has no text. Skipping...")
-                continue
-
-            updated_text = replace_referenced_text(node["text"], node_dict)
-            node_tokens = self.num_tokens_from_string(updated_text, model)
-
-            if node_tokens > max_tokens:
-                logger.warning(
-                    f"Node {node['node_id']} - {node_tokens} tokens, has exceeded the max_tokens limit. Skipping..."
-                )
-                continue
-
-            if current_tokens + node_tokens > max_tokens:
-                if current_batch:  # Only append if there are items
-                    batches.append(current_batch)
-                current_batch = []
-                current_tokens = 0
-
-            current_batch.append(
-                DocstringRequest(node_id=node["node_id"], text=updated_text)
-            )
-            current_tokens += node_tokens
 
-        if current_batch:
-            batches.append(current_batch)
-
-        total_nodes = sum(len(batch) for batch in batches)
-        print(f"Batched {total_nodes} nodes into {len(batches)} batches")
-        print(f"Batch sizes: {[len(batch) for batch in batches]}")
-
-        return batches
+        plan = self.plan_batches(
+            {node["node_id"]: texts[node["node_id"]] for node in nodes if node.get("text")},
+            max_tokens,
+            model,
+        )
+        return [
+            [DocstringRequest(node_id=node_id, text=text) for node_id, text in batch]
+            for batch in plan.batches
+        ]
 
     def batch_entry_points(
         self,
@@ -248,6 +504,7 @@ class InferenceService:
         current_batch = []
         current_tokens = 0
 
+        entry_points_data = []
         for entry_point, neighbors in entry_points_neighbors.items():
             entry_docstring = docstring_lookup.get(entry_point, "")
             neighbor_docstrings = [
@@ -256,16 +513,16 @@ class InferenceService:
             ]
             flow_description = "\n".join(neighbor_docstrings)
 
-            entry_point_data = {
+            entry_points_data.append({
                 "node_id": entry_point,
                 "entry_docstring": entry_docstring,
                 "flow_description": entry_docstring + "\n" + flow_description,
-            }
-
-            entry_point_tokens = self.num_tokens_from_string(
-                entry_docstring + flow_description, model
-            )
+            })
 
+        token_counts = self.token_counter.count_many(
+            [data["flow_description"] for data in entry_points_data], model
+        )
+        for entry_point_data, entry_point_tokens in zip(entry_points_data, token_counts):
             if entry_point_tokens > max_tokens:
                 continue  # Skip entry points that exceed the max_tokens limit
 
@@ -282,16 +539,244 @@ class InferenceService:
 
         return batches
 
-    async def generate_docstrings(self, repo_id: str="default") -> Dict[str, DocstringResponse]:
+    def generate_flows(self, repo_id: str="default") -> int:
+        return self._run_sync(self.agenerate_flows(repo_id))
+
+    async def agenerate_flows(self, repo_id: str="default") -> int:
+        """Summarizes each entry point's call flow into a ``:NODE:FLOW`` node and returns how many were (re)written."""
+        async with self.async_driver.session() as session:
+            result = await session.run(
+                """
+                MATCH (f:FUNCTION {repoId: $repo_id})
+                RETURN f.node_id AS node_id, f.name AS name, f.file_path AS file_path, f.docstring AS docstring
+                """,
+                repo_id=repo_id,
+            )
+            functions = {record["node_id"]: dict(record) async for record in result}
+            result = await session.run(
+                """
+                MATCH (s:FUNCTION {repoId: $repo_id})-[:REFERENCES]->(t:FUNCTION {repoId: $repo_id})
+                RETURN s.node_id AS source_id, t.node_id AS target_id
+                """,
+                repo_id=repo_id,
+            )
+            calls = [(record["source_id"], record["target_id"]) async for record in result]
+            result = await session.run(
+                "MATCH (f:FLOW {repoId: $repo_id}) RETURN f.node_id AS node_id, f.text_hash AS text_hash",
+                repo_id=repo_id,
+            )
+            old_flows = {record["node_id"]: record["text_hash"] async for record in result}
+
+        # Flows come from FUNCTION -> FUNCTION REFERENCES and are summarized from their members' docstrings
+        flows = find_flows(functions, calls)
+        docstring_lookup = {
+            node_id: f"{function['name']} ({function['file_path']}): {function['docstring'] or ''}"
+            for node_id, function in functions.items()
+        }
+        entry_points = [
+            entry_point for batch in self.batch_entry_points(flows, docstring_lookup) for entry_point in batch
+        ]
+        for entry_point in entry_points:
+            entry_point["flow_id"] = flow_node_id(entry_point["node_id"])
+            entry_point["name"] = functions[entry_point["node_id"]]["name"]
+            entry_point["text_hash"] = DocstringCache.content_hash(entry_point["flow_description"])
+        pending = [e for e in entry_points if old_flows.get(e["flow_id"]) != e["text_hash"]]
+        print(
+            f"Flows for project {repo_id}: {len(entry_points)} entry points, "
+            f"{len(entry_points) - len(pending)} unchanged, {len(pending)} to summarize"
+        )
+
+        cached = self.docstring_cache.get_many(
+            [e["text_hash"] for e in pending],
+            FLOW_PROMPT_VERSION,
+            self.docstring_cache_model,
+            self.embedding_cache_model,
+        )
+        summaries = {
+            e["node_id"]: DocstringNode(
+                node_id=e["node_id"], docstring=cached[e["text_hash"]].docstring, tags=cached[e["text_hash"]].tags
+            )
+            for e in pending
+            if e["text_hash"] in cached
+        }
+        embeddings = {
+            e["node_id"]: cached[e["text_hash"]].embedding
+            for e in pending
+            if e["text_hash"] in cached and cached[e["text_hash"]].embedding is not None
+        }
+        to_summarize = [e for e in pending if e["node_id"] not in summaries]
+        batches = self.batch_entry_points(
+            {e["node_id"]: flows[e["node_id"]] for e in to_summarize}, docstring_lookup
+        )
+        semaphore = asyncio.Semaphore(self.parallel_requests)
+        by_entry_point = {e["node_id"]: e for e in to_summarize}
+
+        async def summarize(batch):
+            async with semaphore:
+                try:
+                    response = await self.generate_flow_response(
+                        [dict(entry_point, name=by_entry_point[entry_point["node_id"]]["name"]) for entry_point in batch]
+                    )
+                except Exception as e:
+                    logger.warning(f"Flows for project {repo_id}: LLM request failed: {e}")
+                    return
+                requested_ids = {entry_point["node_id"] for entry_point in batch}
+                for summary in response.docstrings:
+                    if summary.node_id in requested_ids:
+                        summaries.setdefault(summary.node_id, summary)
+
+        await asyncio.gather(*(summarize(batch) for batch in batches))
+        missing = [e["node_id"] for e in pending if e["node_id"] not in summaries]
+        if missing:
+            logger.warning(f"Flows for project {repo_id}: no summary for {len(missing)} entry points, retried next run")
+
+        to_embed = [node_id for node_id in summaries if not embeddings.get(node_id)]
+        if to_embed:
+            vectors = await self.embeddings.embed([summaries[node_id].docstring for node_id in to_embed])
+            for node_id, vector in zip(to_embed, vectors):
+                embeddings[node_id] = vector.tolist()
+        self.docstring_cache.put_many(
+            (
+                (e["text_hash"], summaries[e["node_id"]].docstring, summaries[e["node_id"]].tags, embeddings[e["node_id"]])
+                for e in pending
+                if e["node_id"] in summaries
+                and (e["text_hash"] not in cached or cached[e["text_hash"]].embedding is None)
+            ),
+            FLOW_PROMPT_VERSION,
+            self.docstring_cache_model,
+            self.embedding_cache_model,
+        )
+
+        # FLOW nodes are embedded and linked to their members by FLOW_STEP edges, so one vector hit
+        # returns a whole flow. A changed flow keeps its old summary until the new one is available
+        current_ids = {e["flow_id"] for e in entry_points}
+        stale_ids = [flow_id for flow_id in old_flows if flow_id not in current_ids]
+        stale_ids += [e["flow_id"] for e in pending if e["flow_id"] in old_flows and e["node_id"] in summaries]
+        labels = ["NODE", "FLOW"] + ([repo_partition_label(repo_id)] if partition_by_repo() else [])
+        new_flows = [
+            {
+                "labels": labels,
+                "members": [e["node_id"]] + flows[e["node_id"]],
+                "properties": {
+                    "node_id": e["flow_id"],
+                    "repoId": repo_id,
+                    "type": "FLOW",
+                    "name": f"{e['name']} flow",
+                    "entry_point": e["node_id"],
+                    "file_path": functions[e["node_id"]]["file_path"],
+                    "text": e["flow_description"],
+                    "text_hash": e["text_hash"],
+                    "docstring": summaries[e["node_id"]].docstring,
+                    "tags": summaries[e["node_id"]].tags,
+                    "embedding": embeddings[e["node_id"]],
+                },
+            }
+            for e in pending
+            if e["node_id"] in summaries
+        ]
+        batch_size = 300
+        nodes_delta, relationship_delta = 0, 0
+        async with self.async_driver.session() as session:
+            for i in range(0, len(stale_ids), batch_size):
+                summary = await self.awrite(
+                    session,
+                    """
+                    UNWIND $node_ids AS id
+                    MATCH (f:FLOW {repoId: $repo_id, node_id: id})
+                    DETACH DELETE f
+                    """,
+                    node_ids=stale_ids[i : i + batch_size],
+                    repo_id=repo_id,
+                )
+                nodes_delta -= summary.counters.nodes_deleted
+                relationship_delta -= summary.counters.relationships_deleted
+            for i in range(0, len(new_flows), batch_size):
+                summary = await self.awrite(
+                    session,
+                    """
+                    UNWIND $flows AS flow
+                    CALL apoc.create.node(flow.labels, flow.properties) YIELD node AS f
+                    WITH f, flow
+                    UNWIND range(0, size(flow.members) - 1) AS step
+                    MATCH (m:NODE {repoId: $repo_id, node_id: flow.members[step]})
+                    CREATE (f)-[:FLOW_STEP {repoId: $repo_id, step: step}]->(m)
+                    """,
+                    flows=new_flows[i : i + batch_size],
+                    repo_id=repo_id,
+                )
+                nodes_delta += summary.counters.nodes_created
+                relationship_delta += summary.counters.relationships_created
+            if stale_ids or new_flows:
+                await self.abump_graph_version(
+                    session, repo_id, {"FLOW": nodes_delta}, relationship_delta, embedding_delta=nodes_delta
+                )
+
+        index = self.local_index(repo_id)
+        if index is not None:
+            index.remove(stale_ids)
+            index.upsert(
+                [flow["properties"]["node_id"] for flow in new_flows],
+                [flow["properties"]["embedding"] for flow in new_flows],
+            )
+            index.save()
+        return len(new_flows)
+
+    async def generate_flow_response(self, batch: List[Dict[str, str]]) -> DocstringResponse:
+        base_prompt = """
+        You are a senior software engineer documenting how features of a codebase work end to end.
+        Each item below is an entry point followed by the functions it calls, directly or indirectly,
+        in call order, each as `node_id: name (file): docstring`.
+
+        For every entry point, write a summary (3-5 sentences) of its flow: what triggers it, the main
+        steps in call order, the data it reads or writes and the external systems it touches. Refer to
+        functions by name. Tag each flow with the backend or frontend tags that apply (AUTH, DATABASE,
+        API, UTILITY, PRODUCER, CONSUMER, EXTERNAL_SERVICE, CONFIGURATION, UI_COMPONENT, FORM_HANDLING,
+        STATE_MANAGEMENT, DATA_BINDING, ROUTING, EVENT_HANDLING, DATA_FETCHING, ...).
+
+        Your response must be a valid JSON object containing a list of docstrings, where each docstring object has:
+        - node_id: The node_id of the entry point
+        - docstring: The summary of the flow
+        - tags: A list of relevant tags
+
+        Here are the flows:
+
+        {flows}
+        """
+        flows = ""
+        for entry_point in batch:
+            flows += (
+                f"node_id: {entry_point['node_id']} (entry point {entry_point['name']})\n```\n{entry_point['flow_description']}\n```\n\n"
+            )
+        messages = [
+            {
+                "role": "system",
+                "content": "You are an expert software documentation assistant. You will analyze code flows and provide structured documentation in JSON format.",
+            },
+            {
+                "role": "user",
+                "content": base_prompt.format(flows=flows),
+            },
+        ]
+        estimated_tokens = (
+            sum(TokenCounter.approx_count(message["content"]) for message in messages)
+            + 200 * len(batch)
+        )
+        return await self.llm_client.create(
+            messages=messages,
+            response_model=DocstringResponse,
+            estimated_tokens=estimated_tokens,
+        )
+
+    async def generate_docstrings(self, repo_id: str="default", recent_files: Optional[List[str]]=None) -> Dict[str, DocstringResponse]:
         print(
             f"DEBUGNEO4J: Function: {self.generate_docstrings.__name__}, Repo ID: {repo_id}"
         )
-        self.log_graph_stats(repo_id)
-        nodes = self.fetch_graph(repo_id)
+        await self.alog_graph_stats(repo_id)
+        nodes = await self.afetch_graph(repo_id)
         print(
             f"DEBUGNEO4J: After fetch graph, Repo ID: {repo_id}, Nodes: {len(nodes)}"
         )
-        self.log_graph_stats(repo_id)
+        await self.alog_graph_stats(repo_id)
         print(
             f"Creating search indices for project {repo_id} with nodes count {len(nodes)}"
         )
@@ -299,72 +784,466 @@ class InferenceService:
         # print(
         #     f"nodes_to_index {nodes}"
         # )
+        self._progress.pop(repo_id, None)
+        await self.adrop_stale_embedding_count(repo_id)
+        # Ordering only matters once there is more than one tier to order
+        priorities = None
+        if priority_enabled() and len(nodes) > priority_tier_size():
+            priorities = await self.anode_priorities(repo_id, recent_files)
+        if hierarchical_docstrings_enabled():
+            docstrings = await self.process_nodes_hierarchical(nodes, repo_id, structure=nodes, priorities=priorities)
+        else:
+            docstrings = await self.process_nodes(nodes, repo_id, priorities=priorities)
+        await self.aset_progress_phase(repo_id, "documented")
+        return docstrings
+    
+    async def generate_docstrings_updates(
+        self, updated_nodes, repo_id: str="default", recent_files: Optional[List[str]]=None
+    ) -> Dict[str, DocstringResponse]:
         
-        batches = self.batch_nodes(nodes)
-        all_docstrings = {"docstrings": []}
+        if not updated_nodes:
+            return {}
+        self._progress.pop(repo_id, None)
+        await self.adrop_stale_embedding_count(repo_id)
+        priorities = None
+        if priority_enabled() and len(updated_nodes) > priority_tier_size():
+            priorities = await self.anode_priorities(
+                repo_id, recent_files, file_paths={node.get("file_path") or "" for node in updated_nodes}
+            )
+        if hierarchical_docstrings_enabled():
+            docstrings = await self.process_nodes_hierarchical(updated_nodes, repo_id, priorities=priorities)
+        else:
+            docstrings = await self.process_nodes(updated_nodes, repo_id, priorities=priorities)
+        await self.aset_progress_phase(repo_id, "documented")
+        return docstrings
+
+    async def adrop_stale_embedding_count(self, repo_id: str):
+        # Docstring writes only count embeddings with the local index on; recounted when it is turned on
+        if local_index_enabled():
+            return
+        async with self.async_driver.session() as session:
+            await self.awrite(
+                session,
+                "MATCH (m:REPO_META {repoId: $repo_id}) WHERE m.embedding_count IS NOT NULL REMOVE m.embedding_count",
+                repo_id=repo_id,
+            )
 
-        semaphore = asyncio.Semaphore(self.parallel_requests)
+    async def anode_priorities(
+        self, repo_id: str, recent_files: Optional[List[str]]=None, file_paths=None
+    ) -> Dict[str, float]:
+        """Documentation order of the repo's nodes: entry points, central nodes and recently changed files first."""
+        # file_paths scopes the ranking to those files' nodes and their REFERENCES neighbours.
+        scoped = file_paths is not None
+        async with self.async_driver.session() as session:
+            result = await session.run(
+                f"""
+                MATCH (n:NODE {{repoId: $repo_id}})
+                WHERE NOT n:FLOW {"AND n.file_path IN $file_paths" if scoped else ""}
+                RETURN n.node_id AS node_id, n.type AS type, n.file_path AS file_path
+                """,
+                repo_id=repo_id,
+                file_paths=list(file_paths or []),
+            )
+            nodes = {record["node_id"]: dict(record) async for record in result}
+            result = await session.run(
+                f"""
+                MATCH (s:NODE {{repoId: $repo_id}})-[:REFERENCES]->(t:NODE {{repoId: $repo_id}})
+                {"WHERE s.file_path IN $file_paths OR t.file_path IN $file_paths" if scoped else ""}
+                RETURN s.node_id AS source_id, s.type AS source_type, s.file_path AS source_file,
+                    t.node_id AS target_id, t.type AS target_type, t.file_path AS target_file
+                """,
+                repo_id=repo_id,
+                file_paths=list(file_paths or []),
+            )
+            references = []
+            async for record in result:
+                references.append((record["source_id"], record["target_id"]))
+                # Neighbours outside the scope still decide who is an entry point
+                for end in ("source", "target"):
+                    nodes.setdefault(
+                        record[f"{end}_id"],
+                        {
+                            "node_id": record[f"{end}_id"],
+                            "type": record[f"{end}_type"],
+                            "file_path": record[f"{end}_file"],
+                        },
+                    )
+        return node_priorities(list(nodes.values()), references, recent_files)
+
+    def get_progress(self, repo_id: str="default") -> Optional[Dict]:
+        return self._run_sync(self.aget_progress(repo_id))
+
+    async def aget_progress(self, repo_id: str="default") -> Optional[Dict]:
+        """Progress of the repo's docstring run: from memory, or as last written to REPO_META by any process."""
+        progress = self._progress.get(repo_id)
+        if progress is not None:
+            return progress.as_dict()
+        async with self.async_driver.session() as session:
+            result = await session.run(
+                "MATCH (m:REPO_META {repoId: $repo_id}) RETURN m {.*} AS meta", repo_id=repo_id
+            )
+            record = await result.single()
+        if record is None or "progress_phase" not in record["meta"]:
+            return None
+        progress = {key[len("progress_"):]: value for key, value in record["meta"].items() if key.startswith("progress_")}
+        return {"repo_id": repo_id, **progress}
+
+    async def apersist_progress(self, repo_id: str, force: bool=False):
+        progress = self._progress.get(repo_id)
+        if progress is None or (not force and time.time() - progress.persisted_at < PROGRESS_WRITE_INTERVAL):
+            return
+        progress.persisted_at = time.time()
+        values = {f"progress_{key}": value for key, value in progress.as_dict().items() if key != "repo_id"}
+        try:
+            async with self.async_driver.session() as session:
+                await self.aensure_repo_meta(session)
+                await session.run(
+                    """
+                    MERGE (m:REPO_META {repoId: $repo_id})
+                    ON CREATE SET m.graph_version = randomUUID()
+                    SET m += $values
+                    """,
+                    repo_id=repo_id,
+                    values=values,
+                )
+        except Exception as e:
+            logger.warning(f"Could not store progress of project {repo_id}: {e}")
 
-        async def process_batch(batch, batch_index: int):
-            async with semaphore:
-                print(f"Processing batch {batch_index} for project {repo_id}")
-                response = await self.generate_response(batch, repo_id)
-                if not isinstance(response, DocstringResponse):
-                    logger.warning(
-                        f"Parsing project {repo_id}: Invalid response from LLM. Not an instance of DocstringResponse. Retrying..."
+    async def aset_progress_phase(self, repo_id: str, phase: str):
+        progress = self._progress.get(repo_id)
+        if progress is not None:
+            progress.phase = phase
+            await self.apersist_progress(repo_id, force=True)
+
+    async def process_nodes_hierarchical(
+        self,
+        nodes: List[Dict],
+        repo_id: str="default",
+        structure: Optional[List[Dict]]=None,
+        priorities: Optional[Dict[str, float]]=None,
+    ) -> Dict[str, DocstringResponse]:
+        """Documents ``nodes`` bottom-up in waves, parents from their children's docstrings instead of their code."""
+        # ``structure`` holds every node of the touched files; children that are not
+        # regenerated contribute their stored docstrings
+        if structure is None:
+            structure = await self.afetch_file_nodes(repo_id, {node.get("file_path") or "" for node in nodes})
+        structure_by_id = {node["node_id"]: node for node in structure}
+        for node in nodes:
+            structure_by_id.setdefault(node["node_id"], node)
+        children = containment(list(structure_by_id.values()))
+        levels = summary_levels(list(structure_by_id.values()), children)
+        docstrings = {node_id: node.get("docstring") for node_id, node in structure_by_id.items()}
+        expanded_texts = self.expand_references(nodes)
+
+        waves = defaultdict(list)
+        for node in nodes:
+            waves[levels.get(node["node_id"], 0)].append(node)
+        if repo_id not in self._progress:
+            self._progress[repo_id] = DocstringProgress(
+                repo_id, sum(1 for node in nodes if children.get(node["node_id"]) or node["node_id"] in expanded_texts)
+            )
+        flat_tokens, sent_tokens = 0, 0
+        for level in sorted(waves):
+            wave = waves[level]
+            texts = {}
+            for node in wave:
+                child_ids = children.get(node["node_id"])
+                if child_ids:
+                    texts[node["node_id"]] = skeleton_text(
+                        node, [structure_by_id[child_id] for child_id in child_ids], docstrings
                     )
-                    response = await self.generate_response(batch, repo_id)
-                else:
-                    self.update_neo4j_with_docstrings(repo_id, response)
-                return response
+                elif node["node_id"] in expanded_texts:
+                    texts[node["node_id"]] = expanded_texts[node["node_id"]]
+                flat_tokens += TokenCounter.approx_count(expanded_texts.get(node["node_id"], ""))
+            sent_tokens += sum(TokenCounter.approx_count(text) for text in texts.values())
+            print(f"Docstring wave {level} for project {repo_id}: {len(texts)} nodes")
+            await self.aset_progress_phase(repo_id, f"wave {level}")
+            await self.process_nodes(wave, repo_id, texts=texts, priorities=priorities)
+            # Parents are built from what was actually stored, including cache hits and resumed nodes
+            docstrings.update(await self.afetch_docstrings(repo_id, [node["node_id"] for node in wave]))
+        print(
+            f"Hierarchical docstrings for project {repo_id}: ~{sent_tokens} code tokens sent "
+            f"instead of ~{flat_tokens}"
+        )
+        return {"docstrings": []}
 
-        tasks = [process_batch(batch, i) for i, batch in enumerate(batches)]
-        results = await asyncio.gather(*tasks)
+    async def afetch_file_nodes(self, repo_id: str, file_paths) -> List[Dict]:
+        async with self.async_driver.session() as session:
+            result = await session.run(
+                """
+                MATCH (n:NODE {repoId: $repo_id})
+                WHERE n.file_path IN $file_paths AND NOT n:FLOW
+                RETURN n.node_id AS node_id, n.text AS text, n.file_path AS file_path, n.start_line AS start_line,
+                    n.end_line AS end_line, n.name AS name, n.type AS type, n.docstring AS docstring
+                """,
+                repo_id=repo_id,
+                file_paths=list(file_paths),
+            )
+            return [dict(record) async for record in result]
 
-        for result in results:
-            if not isinstance(result, DocstringResponse):
-                logger.error(
-                    f"Project {repo_id}: Invalid response from during inference. Manually verify the project completion."
-                )
+    async def afetch_docstrings(self, repo_id: str, node_ids: List[str]) -> Dict[str, Optional[str]]:
+        async with self.async_driver.session() as session:
+            result = await session.run(
+                """
+                UNWIND $node_ids AS id
+                MATCH (n:NODE {repoId: $repo_id, node_id: id})
+                RETURN n.node_id AS node_id, n.docstring AS docstring
+                """,
+                repo_id=repo_id,
+                node_ids=node_ids,
+            )
+            return {record["node_id"]: record["docstring"] async for record in result}
+
+    @property
+    def docstring_cache_model(self) -> str:
+        return self.llm_client.model_name
+
+    @property
+    def embedding_cache_model(self) -> str:
+        # Cached embeddings are only valid for the embedding model, backend and precision that produced them
+        backend = self.embedding_model
+        return f"{self.embedding_model_name}:{backend.name}:{backend.precision}"
+
+    async def apply_cached_docstrings(self, nodes: List[Dict], hashes: Dict[str, str], repo_id: str="default") -> List[Dict]:
+        """Writes cached docstrings for unchanged nodes and returns the nodes that still need the LLM."""
+        hashes = {node["node_id"]: hashes[node["node_id"]] for node in nodes if node["node_id"] in hashes}
+        cached = self.docstring_cache.get_many(
+            hashes.values(), DOCSTRING_PROMPT_VERSION, self.docstring_cache_model, self.embedding_cache_model
+        )
+        hits = [node_id for node_id, content_hash in hashes.items() if content_hash in cached]
+        if hits:
+            written = await self.aupdate_neo4j_with_docstrings(
+                repo_id,
+                DocstringResponse(
+                    docstrings=[
+                        DocstringNode(
+                            node_id=node_id,
+                            docstring=cached[hashes[node_id]].docstring,
+                            tags=cached[hashes[node_id]].tags,
+                        )
+                        for node_id in hits
+                    ]
+                ),
+                embeddings={
+                    node_id: cached[hashes[node_id]].embedding
+                    for node_id in hits
+                    if cached[hashes[node_id]].embedding is not None
+                },
+            )
+            # Docstrings whose embedding came from another backend were re-embedded above
+            self.docstring_cache.put_many(
+                (
+                    (hashes[item["node_id"]], item["docstring"], item["tags"], item["embedding"])
+                    for item in written
+                    if cached[hashes[item["node_id"]]].embedding is None
+                ),
+                DOCSTRING_PROMPT_VERSION,
+                self.docstring_cache_model,
+                self.embedding_cache_model,
+            )
+        print(f"Docstring cache: {len(hits)} hits, {len(hashes) - len(hits)} misses for project {repo_id}")
+        hit_ids = set(hits)
+        return [node for node in nodes if node["node_id"] not in hit_ids]
 
-        updated_docstrings = all_docstrings
-        return updated_docstrings
-    
-    async def generate_docstrings_updates(self, updated_nodes,repo_id: str="default") -> Dict[str, DocstringResponse]:
-        
-        if not updated_nodes:
-            return {}
-        
-        batches = self.batch_nodes(updated_nodes)
+    async def process_nodes(
+        self,
+        nodes: List[Dict],
+        repo_id: str="default",
+        texts: Optional[Dict[str, str]]=None,
+        priorities: Optional[Dict[str, float]]=None,
+    ) -> Dict[str, DocstringResponse]:
+        # ``texts`` overrides what is sent per node_id (used by the hierarchical waves)
+        if texts is None:
+            texts = self.expand_references(nodes)
+        hashes = {node_id: DocstringCache.content_hash(text) for node_id, text in texts.items()}
+        progress = self._progress.get(repo_id)
+        if progress is None:
+            progress = self._progress[repo_id] = DocstringProgress(repo_id, len(texts))
+
+        # Resume a crashed run: skip nodes it already documented, unless their code changed since
+        ledger = RunLedger(repo_id)
+        completed = ledger.load()
+        if completed:
+            resumed = {node_id for node_id, content_hash in hashes.items() if completed.get(node_id) == content_hash}
+            print(f"Resuming project {repo_id}: {len(resumed)} nodes already documented")
+            nodes = [node for node in nodes if node["node_id"] not in resumed]
+            progress.advance(len(resumed))
+            await self.abackfill_local_index(repo_id, resumed)
+
+        pending_nodes = await self.apply_cached_docstrings(nodes, hashes, repo_id)
+        progress.advance(len(nodes) - len(pending_nodes))
+        pending_texts = {
+            node["node_id"]: texts[node["node_id"]]
+            for node in pending_nodes
+            if node["node_id"] in texts
+        }
+        # Near-identical bodies (getters, setters, overloads) are sent once and fanned out
+        duplicates = None
+        if dedup_enabled():
+            duplicates = group_duplicates(pending_texts, {node["node_id"]: node.get("type") for node in pending_nodes})
+            duplicate_ids = duplicates.member_ids()
+            if duplicate_ids:
+                print(
+                    f"Dedup for project {repo_id}: {len(duplicate_ids)} nodes share the docstring of "
+                    f"{len(duplicates.members)} representatives"
+                )
+                pending_texts = {node_id: text for node_id, text in pending_texts.items() if node_id not in duplicate_ids}
         all_docstrings = {"docstrings": []}
+        # Docstrings of the windows of oversized nodes, by parent node_id and window index
+        part_docstrings = defaultdict(dict)
+        failed_node_ids = set()
 
         semaphore = asyncio.Semaphore(self.parallel_requests)
 
-        async def process_batch(batch, batch_index: int):
+        async def process_batch(batch, batch_index: int, attempt: int = 0):
+            if attempt:
+                await asyncio.sleep(retry_delay(attempt))
             async with semaphore:
-                print(f"Processing batch {batch_index} for project {repo_id}")
-                response = await self.generate_response(batch, repo_id)
+                print(f"Processing batch {batch_index} for project {repo_id}" + (f" (retry {attempt})" if attempt else ""))
+                try:
+                    response = await self.generate_response(batch, repo_id)
+                except Exception as e:
+                    logger.warning(f"Parsing project {repo_id}: LLM request failed: {e}")
+                    response = None
                 if not isinstance(response, DocstringResponse):
                     logger.warning(
                         f"Parsing project {repo_id}: Invalid response from LLM. Not an instance of DocstringResponse. Retrying..."
                     )
-                    response = await self.generate_response(batch, repo_id)
+                    missing = batch
                 else:
-                    self.update_neo4j_with_docstrings(repo_id, response)
-                return response
-
-        tasks = [process_batch(batch, i) for i, batch in enumerate(batches)]
-        results = await asyncio.gather(*tasks)
-
-        for result in results:
-            if not isinstance(result, DocstringResponse):
-                logger.error(
-                    f"Project {repo_id}: Invalid response from during inference. Manually verify the project completion."
+                    requested_ids = {request.node_id for request in batch}
+                    node_docstrings = []
+                    returned_ids = set()
+                    for docstring in response.docstrings:
+                        # Ignore node_ids the model invented or repeated
+                        if docstring.node_id not in requested_ids or docstring.node_id in returned_ids:
+                            continue
+                        returned_ids.add(docstring.node_id)
+                        if BatchPlanner.is_part_id(docstring.node_id):
+                            parent_id, index = BatchPlanner.parse_part_id(docstring.node_id)
+                            part_docstrings[parent_id][index] = docstring.docstring
+                        else:
+                            node_docstrings.append(docstring)
+                    written = await self.aupdate_neo4j_with_docstrings(
+                        repo_id, DocstringResponse(docstrings=node_docstrings)
+                    )
+                    if duplicates is not None:
+                        written += await self.afan_out_docstrings(repo_id, written, duplicates)
+                    self.docstring_cache.put_many(
+                        (
+                            (
+                                hashes[item["node_id"]],
+                                item["docstring"],
+                                item["tags"],
+                                item["embedding"],
+                            )
+                            for item in written
+                            if item["node_id"] in hashes
+                        ),
+                        DOCSTRING_PROMPT_VERSION,
+                        self.docstring_cache_model,
+                        self.embedding_cache_model,
+                    )
+                    ledger.record(
+                        (item["node_id"], hashes[item["node_id"]])
+                        for item in written
+                        if item["node_id"] in hashes
+                    )
+                    index = self.local_index(repo_id)
+                    if index is not None:
+                        # Already upserted with the write; persisted periodically so a crash loses little
+                        index.save_if_due()
+                    progress.advance(len(written))
+                    await self.apersist_progress(repo_id)
+                    missing = [request for request in batch if request.node_id not in returned_ids]
+                    if missing:
+                        logger.warning(
+                            f"Parsing project {repo_id}: LLM response omitted {len(missing)} of {len(batch)} nodes. Re-queueing..."
+                        )
+
+            if missing:
+                if attempt >= DOCSTRING_MAX_RETRIES:
+                    failed_node_ids.update(request.node_id for request in missing)
+                    return response
+                # Re-queue only the missing nodes, in small batches that are more likely to succeed
+                await asyncio.gather(
+                    *(
+                        process_batch(missing[i : i + RETRY_BATCH_SIZE], batch_index, attempt + 1)
+                        for i in range(0, len(missing), RETRY_BATCH_SIZE)
+                    )
                 )
+            return response
+
+        # Oversized nodes are documented hierarchically: first their windows, then the
+        # node itself from the window docstrings, one level per iteration
+        for level in range(MAX_SUMMARY_LEVELS):
+            if not pending_texts:
+                break
+            # Tiers are planned separately and queued highest priority first, so the
+            # most useful nodes are written (and searchable) early in a long run
+            plans = [self.plan_batches(tier) for tier in priority_tiers(pending_texts, priorities)]
+            batches = [
+                [DocstringRequest(node_id=node_id, text=text) for node_id, text in batch]
+                for plan in plans
+                for batch in plan.batches
+            ]
+            tasks = [process_batch(batch, i) for i, batch in enumerate(batches)]
+            await asyncio.gather(*tasks)
+
+            next_texts = {}
+            split_nodes = {node_id: part_count for plan in plans for node_id, part_count in plan.split_nodes.items()}
+            for node_id, part_count in split_nodes.items():
+                parts = part_docstrings.pop(node_id, {})
+                if not parts:
+                    logger.error(f"Project {repo_id}: No part docstrings for oversized node {node_id}")
+                    failed_node_ids.add(node_id)
+                    continue
+                next_texts[node_id] = BatchPlanner.summary_text(pending_texts[node_id], parts, part_count)
+            pending_texts = next_texts
+
+        if pending_texts:
+            # Still split after the last level: never documented, so the run must not count as complete
+            logger.error(
+                f"Project {repo_id}: {len(pending_texts)} oversized nodes still split after "
+                f"{MAX_SUMMARY_LEVELS} summary levels: {sorted(pending_texts)}"
+            )
+            failed_node_ids.update(pending_texts)
+        if duplicates is not None:
+            for node_id in list(failed_node_ids):
+                failed_node_ids.update(duplicates.members.get(node_id, []))
+        progress.fail(len(failed_node_ids))
+        if failed_node_ids:
+            logger.error(
+                f"Project {repo_id}: {len(failed_node_ids)} nodes got no docstring after {DOCSTRING_MAX_RETRIES} retries. "
+                "Run inference again to resume."
+            )
+        else:
+            ledger.clear()
+        index = self.local_index(repo_id)
+        if index is not None:
+            index.save()
 
         updated_docstrings = all_docstrings
         return updated_docstrings
 
+    async def afan_out_docstrings(self, repo_id: str, written: List[Dict], duplicates: DuplicateGroups) -> List[Dict]:
+        """Gives the duplicates of each written representative its docstring, with their own names."""
+        docstrings, embeddings = [], {}
+        for item in written:
+            for member_id in duplicates.members.get(item["node_id"], []):
+                docstring = rename_docstring(
+                    item["docstring"], duplicates.identifiers[item["node_id"]], duplicates.identifiers[member_id]
+                )
+                docstrings.append(DocstringNode(node_id=member_id, docstring=docstring, tags=item["tags"]))
+                if docstring == item["docstring"]:
+                    # Same text, same vector: only renamed docstrings are embedded again
+                    embeddings[member_id] = item["embedding"]
+        if not docstrings:
+            return []
+        return await self.aupdate_neo4j_with_docstrings(
+            repo_id, DocstringResponse(docstrings=docstrings), embeddings=embeddings
+        )
+
     async def generate_response(
         self,
         batch: List[DocstringRequest],
@@ -448,53 +1327,129 @@ class InferenceService:
             },
         ]
 
-        client = instructor.from_gemini(
-        client=genai.GenerativeModel(
-            model_name="models/gemini-2.0-flash",  # model defaults to "gemini-pro"
-        ),
-        mode=instructor.Mode.GEMINI_JSON,
+        # Prompt plus roughly what the docstrings for the batch will take
+        estimated_tokens = (
+            sum(TokenCounter.approx_count(message["content"]) for message in messages)
+            + 100 * len(batch)
         )
-        response = client.chat.completions.create(
+        response = await self.llm_client.create(
             messages=messages,
             response_model=DocstringResponse,
+            estimated_tokens=estimated_tokens,
         )
         return response
 
     def generate_embedding(self, text: str) -> List[float]:
-        embedding = self.embedding_model.encode(text)
-        return embedding.tolist()
+        return self.embeddings.encode_many([text])[0].tolist()
 
     def update_neo4j_with_docstrings(self, repo_id: str, docstrings: DocstringResponse):
-        with self.driver.session() as session:
+        return self._run_sync(self.aupdate_neo4j_with_docstrings(repo_id, docstrings))
+
+    async def aupdate_neo4j_with_docstrings(
+        self,
+        repo_id: str,
+        docstrings: DocstringResponse,
+        embeddings: Optional[Dict[str, List[float]]] = None,
+    ) -> List[Dict]:
+        embeddings = dict(embeddings or {})
+        to_embed = [n for n in docstrings.docstrings if not embeddings.get(n.node_id)]
+        if to_embed:
+            vectors = await self.embeddings.embed([n.docstring for n in to_embed])
+            for n, vector in zip(to_embed, vectors):
+                embeddings[n.node_id] = vector.tolist()
+        async with self.async_driver.session() as session:
             batch_size = 300
             docstring_list = [
                 {
                     "node_id": n.node_id,
                     "docstring": n.docstring,
                     "tags": n.tags,
-                    "embedding": self.generate_embedding(n.docstring),
+                    "embedding": embeddings[n.node_id],
                 }
                 for n in docstrings.docstrings
             ]
-            repo_path = "default"
-            is_local_repo = True if repo_path else False
             for i in range(0, len(docstring_list), batch_size):
                 batch = docstring_list[i : i + batch_size]
-                session.run(
-                    """
-                    UNWIND $batch AS item
-                    MATCH (n:NODE {repoId: $repo_id, node_id: item.node_id})
-                    SET n.docstring = item.docstring,
-                        n.embedding = item.embedding,
-                        n.tags = item.tags
+                query = """
+                UNWIND $batch AS item
+                MATCH (n:NODE {repoId: $repo_id, node_id: item.node_id})
+                WITH n, item, n.embedding IS NULL AS newly_embedded
+                SET n.docstring = item.docstring,
+                    n.embedding = item.embedding,
+                    n.tags = item.tags
+                """
+                if local_index_enabled():
+                    # Every batch then waits on the REPO_META lock, so only when the count is used
+                    query += """
+                    WITH sum(CASE WHEN newly_embedded THEN 1 ELSE 0 END) AS added
+                    MATCH (m:REPO_META {repoId: $repo_id})
+                    SET m.embedding_count = m.embedding_count + added
                     """
-                    + ("" if is_local_repo else "REMOVE n.text, n.signature"),
-                    batch=batch,
-                    repo_id=repo_id,
-                )
+                await self.awrite(session, query, batch=batch, repo_id=repo_id)
+        index = self.local_index(repo_id)
+        if index is not None:
+            index.upsert([d["node_id"] for d in docstring_list], [d["embedding"] for d in docstring_list])
+        return docstring_list
+
+    @staticmethod
+    def prepare_node(node_id, node_data, project_id="default") -> Optional[Dict]:
+        # Get the node type and ensure it's one of our expected types
+        node_type = node_data.get("type", "UNKNOWN")
+        if node_type == "UNKNOWN":
+            return None
+        # Initialize labels with NODE
+        labels = ["NODE"]
+
+        # Add specific type label if it's a valid type
+        if node_type in NODE_TYPE_LABELS:
+            labels.append(node_type)
+        if partition_by_repo():
+            labels.append(repo_partition_label(project_id))
+
+        # Prepare node data
+        processed_node = {
+            "name": node_data.get(
+                "name", node_id
+            ),  # Use node_id as fallback
+            "file_path": node_data.get("file", ""),
+            "start_line": node_data.get("line", -1),
+            "end_line": node_data.get("end_line", -1),
+            "repoId": project_id,
+            "node_id": generate_node_id(node_id),
+            "type": node_type,
+            "text": node_data.get("text", ""),
+            "text_hash": DocstringCache.content_hash(node_data.get("text", "") or ""),
+            "labels": labels,
+        }
+
+        # Remove None values
+        return {k: v for k, v in processed_node.items() if v is not None}
+
+    @staticmethod
+    def label_split(node: Dict) -> Dict:
+        """``{labels, properties}`` for ``apoc.create.node``, so ``labels`` is not also stored as a property."""
+        return {"labels": node["labels"], "properties": {k: v for k, v in node.items() if k != "labels"}}
+
+    @staticmethod
+    def prepare_edge(source, target, data, project_id="default") -> Dict:
+        edge_data = {
+            "source_id": generate_node_id(source),
+            "target_id": generate_node_id(target),
+            "type": data.get("type", "REFERENCES"),
+            "repoId": project_id,
+        }
+        # Remove any null values from edge_data
+        return {k: v for k, v in edge_data.items() if v is not None}
 
     def store_graph_to_neo4j(self,nx_graph,project_id="default"):
-        with self.driver.session() as session:
+        return self._run_sync(self.astore_graph_to_neo4j(nx_graph, project_id))
+
+    async def astore_graph_to_neo4j(self,nx_graph,project_id="default"):
+        RunLedger(project_id).clear()
+        index = self.local_index(project_id)
+        if index is not None:
+            index.clear()
+        async with self.async_driver.session() as session:
             node_count = nx_graph.number_of_nodes()
             if node_count == 0:
                 print("No nodes to store")
@@ -502,72 +1457,46 @@ class InferenceService:
             print(f"Number of node: {node_count}")
             # Batch insert nodes
             batch_size = 300
+            node_deltas = defaultdict(int)
+            relationships_created = 0
+            all_nodes = list(nx_graph.nodes(data=True))
             for i in range(0, node_count, batch_size):
-                batch_nodes = list(nx_graph.nodes(data=True))[i : i + batch_size]
+                batch_nodes = all_nodes[i : i + batch_size]
                 nodes_to_create = []
 
                 for node_id, node_data in batch_nodes:
-                    # Get the node type and ensure it's one of our expected types
-                    node_type = node_data.get("type", "UNKNOWN")
-                    if node_type == "UNKNOWN":
+                    processed_node = self.prepare_node(node_id, node_data, project_id)
+                    if processed_node is None:
                         continue
-                    # Initialize labels with NODE
-                    labels = ["NODE"]
-
-                    # Add specific type label if it's a valid type
-                    if node_type in ["FILE", "CLASS", "FUNCTION", "INTERFACE"]:
-                        labels.append(node_type)
-
-                    # Prepare node data
-                    processed_node = {
-                        "name": node_data.get(
-                            "name", node_id
-                        ),  # Use node_id as fallback
-                        "file_path": node_data.get("file", ""),
-                        "start_line": node_data.get("line", -1),
-                        "end_line": node_data.get("end_line", -1),
-                        "repoId": project_id,
-                        "node_id": generate_node_id(node_id),
-                        "type": node_type,
-                        "text": node_data.get("text", ""),
-                        "labels": labels,
-                    }
-
-                    # Remove None values
-                    processed_node = {
-                        k: v for k, v in processed_node.items() if v is not None
-                    }
                     nodes_to_create.append(processed_node)
+                    node_deltas[processed_node["type"]] += 1
 
                 # Create nodes with labels
-                session.run(
+                await self.awrite(
+                    session,
                     """
                     UNWIND $nodes AS node
-                    CALL apoc.create.node(node.labels, node) YIELD node AS n
+                    CALL apoc.create.node(node.labels, node.properties) YIELD node AS n
                     RETURN count(*) AS created_count
                     """,
-                    nodes=nodes_to_create,
+                    nodes=[self.label_split(node) for node in nodes_to_create],
                 )
 
             relationship_count = nx_graph.number_of_edges()
             print(f"Creating {relationship_count} relationships")
 
             # Create relationships in batches
+            all_edges = list(nx_graph.edges(data=True))
             for i in range(0, relationship_count, batch_size):
-                batch_edges = list(nx_graph.edges(data=True))[i : i + batch_size]
+                batch_edges = all_edges[i : i + batch_size]
                 edges_to_create = []
                 for source, target, data in batch_edges:
-                    edge_data = {
-                        "source_id": generate_node_id(source),
-                        "target_id": generate_node_id(target),
-                        "type": data.get("type", "REFERENCES"),
-                        "repoId": project_id,
-                    }
-                    # Remove any null values from edge_data
-                    edge_data = {k: v for k, v in edge_data.items() if v is not None}
-                    edges_to_create.append(edge_data)
+                    edges_to_create.append(
+                        self.prepare_edge(source, target, data, project_id)
+                    )
 
-                session.run(
+                summary = await self.awrite(
+                    session,
                     """
                     UNWIND $edges AS edge
                     MATCH (source:NODE {node_id: edge.source_id, repoId: edge.repoId})
@@ -577,77 +1506,393 @@ class InferenceService:
                     """,
                     edges=edges_to_create,
                 )
+                relationships_created += summary.counters.relationships_created
                 print("Graph stored in Neo4j successfully.")
+            await self.abump_graph_version(session, project_id, node_deltas, relationships_created)
+
+    def export_bulk_import(self, nx_graph, output_dir: str, project_id="default") -> Dict[str, str]:
+        """Writes the graph as neo4j-admin CSVs plus loader scripts instead of storing it over Bolt."""
+        nodes = (
+            node
+            for node in (
+                self.prepare_node(node_id, node_data, project_id)
+                for node_id, node_data in nx_graph.nodes(data=True)
+            )
+            if node is not None
+        )
+        edges = (
+            self.prepare_edge(source, target, data, project_id)
+            for source, target, data in nx_graph.edges(data=True)
+        )
+        return BulkImportExporter(output_dir, project_id).export(nodes, edges)
 
-    def project_setup(self,repo_dir: str,cleanup: bool=False):
+    def project_setup(self,repo_dir: str,cleanup: bool=False,export_dir: Optional[str]=None,project_id: str="default"):
         if(cleanup):
-            self.cleanup_neo4j()
+            self.cleanup_neo4j(project_id)
         map=RepoMap(root=repo_dir,verbose=True,main_model=SimpleTokenCounter(),io=SimpleIO(),)
         nx_graph = map.create_graph(repo_dir)
         # visualize_graph(nx_graph)
-        self.store_graph_to_neo4j(nx_graph)
+        if export_dir:
+            return self.export_bulk_import(nx_graph, export_dir, project_id)
+        self.store_graph_to_neo4j(nx_graph, project_id)
 
-    def project_updates(self,repo_dir: str,changed_files,cleanup: bool=False):
-        
+    def project_updates(self,repo_dir: str,changed_files,cleanup: bool=False,project_id: str="default"):
+        """Brings the repo's graph in line with ``repo_dir``; ``cleanup=True`` rebuilds it (run ``run_inference`` after)."""
         map=RepoMap(root=repo_dir,verbose=True,main_model=SimpleTokenCounter(),io=SimpleIO())
-        
-        
-        if(cleanup):
-            self.cleanup_neo4j()
 
-        if changed_files[0]==-1: #Initial commit
+        if(cleanup):
+            self.cleanup_neo4j(project_id)
             nx_graph = map.create_graph(repo_dir)
-            self.store_graph_to_neo4j(nx_graph)
-        else:
-            nx_graph = map.check_for_updates(changed_files,repo_dir)
-            updated_nodes = self.update_graph_to_neo4j(nx_graph)
-            if updated_nodes:
-                asyncio.run(self.generate_docstrings_updates(updated_nodes))
-
-    def update_graph_to_neo4j(self,nx_graph,project_id="default"):
-       
-        with self.driver.session() as session:
-            node_count = nx_graph.number_of_nodes()
-            if node_count == 0:
-                print("No nodes to update")
-                return []
-            print(f"Number of node: {node_count}")
-            # Batch insert nodes
-            batch_size = 300
-            for i in range(0, node_count, batch_size):
-                batch_nodes = list(nx_graph.nodes(data=True))[i : i + batch_size]
-                nodes_to_update = []
+            self.store_graph_to_neo4j(nx_graph, project_id)
+            return None
 
-                for node_id, node_data in batch_nodes:
-                    
-                    nodes_to_update.append({
-                        "node_id": generate_node_id(node_id),
-                        "text": node_data.get("text", ""),
-                        "repo_id": project_id
-                        })
-                    
+        print(f"Changed files: {changed_files}")
+        # The whole tree is parsed so references into unchanged files resolve, but only
+        # the changed files are diffed against Neo4j; [-1] (unknown changes) diffs everything
+        nx_graph = map.create_graph(repo_dir)
+        scoped_files = None if not changed_files or -1 in changed_files else list(changed_files)
+        return self._run_sync(
+            self.aingest_repository(
+                nx_graph, project_id, recent_files=recent_files_from_git(repo_dir), changed_files=scoped_files
+            )
+        )
 
-                query = """
-                UNWIND $nodes AS node
-                MATCH (n:NODE {node_id: node.node_id})
-                SET n.text = node.text
+    async def aingest_repository(
+        self,
+        nx_graph,
+        project_id: str="default",
+        full_rebuild: bool=False,
+        recent_files: Optional[List[str]]=None,
+        changed_files: Optional[List[str]]=None,
+    ):
+        """Stores a parsed repository under ``project_id`` and documents it, incrementally unless ``full_rebuild``."""
+        if full_rebuild:
+            await self.acleanup_neo4j(project_id)
+            await self.astore_graph_to_neo4j(nx_graph, project_id)
+            await self.run_inference(project_id, recent_files)
+            return None
+        touched_nodes = await self.aapply_graph_delta(nx_graph, project_id, changed_files)
+        await self.acreate_vector_index(project_id)
+        if touched_nodes:
+            await self.generate_docstrings_updates(touched_nodes, project_id, recent_files)
+        if flows_enabled():
+            # Cheap when nothing changed: flows with the same description are kept
+            await self.aset_progress_phase(project_id, "flows")
+            await self.agenerate_flows(project_id)
+        await self.aset_progress_phase(project_id, "done")
+        # Also initializes the counters of repos stored before they existed
+        await self.alog_graph_stats(project_id)
+        return touched_nodes
+
+    def apply_graph_delta(self, nx_graph, project_id="default", changed_files: Optional[List[str]]=None) -> List[Dict]:
+        return self._run_sync(self.aapply_graph_delta(nx_graph, project_id, changed_files))
+
+    async def aapply_graph_delta(self, nx_graph, project_id="default", changed_files: Optional[List[str]]=None) -> List[Dict]:
+        """Applies only the node and edge differences to Neo4j and returns the nodes that need a docstring."""
+        # ``changed_files`` are repo-relative while node paths are relative to the source
+        # directory, so a node is in scope when its path is a suffix of a changed file
+        scope = None
+        if changed_files is not None:
+            scope = set()
+            for path in changed_files:
+                parts = path.replace("\\", "/").split("/")
+                scope.update("/".join(parts[start:]) for start in range(len(parts)))
+        parsed_nodes = {}
+        for node_id, node_data in nx_graph.nodes(data=True):
+            processed_node = self.prepare_node(node_id, node_data, project_id)
+            if processed_node is not None:
+                parsed_nodes[processed_node["node_id"]] = processed_node
+        new_nodes = {
+            node_id: node
+            for node_id, node in parsed_nodes.items()
+            if scope is None or node["file_path"].replace("\\", "/") in scope
+        }
+        new_edges = {}
+        for source, target, data in nx_graph.edges(data=True):
+            edge = self.prepare_edge(source, target, data, project_id)
+            if edge["source_id"] not in parsed_nodes or edge["target_id"] not in parsed_nodes:
+                continue
+            if edge["source_id"] in new_nodes or edge["target_id"] in new_nodes:
+                new_edges[(edge["source_id"], edge["target_id"], edge["type"])] = edge
+
+        batch_size = 300
+        async with self.async_driver.session() as session:
+            result = await session.run(
                 """
-                session.run(query, nodes=nodes_to_update)
-                
-        
-        return nodes_to_update
+                MATCH (n:NODE {repoId: $repo_id})
+                WHERE NOT n:FLOW AND ($file_paths IS NULL OR n.file_path IN $file_paths)
+                RETURN n.node_id AS node_id, n.text_hash AS text_hash,
+                    CASE WHEN n.text_hash IS NULL THEN n.text END AS text,
+                    n.file_path AS file_path, n.start_line AS start_line, n.end_line AS end_line,
+                    n.name AS name, n.type AS type, n.docstring IS NULL AS undocumented
+                """,
+                repo_id=project_id,
+                # Paths are stored with the separator of the machine that parsed them
+                file_paths=sorted(scope | {path.replace("/", "\\") for path in scope}) if scope is not None else None,
+            )
+            old_nodes = {}
+            async for record in result:
+                old_node = dict(record)
+                old_node["legacy"] = old_node["text_hash"] is None
+                if old_node["legacy"]:
+                    # Stored before hashes were recorded
+                    old_node["text_hash"] = DocstringCache.content_hash(old_node["text"] or "")
+                old_nodes[old_node["node_id"]] = old_node
+            result = await session.run(
+                """
+                MATCH (s:NODE {repoId: $repo_id})-[r]->(t:NODE {repoId: $repo_id})
+                WHERE NOT s:FLOW AND ($node_ids IS NULL OR s.node_id IN $node_ids OR t.node_id IN $node_ids)
+                RETURN s.node_id AS source_id, t.node_id AS target_id, type(r) AS type
+                """,
+                repo_id=project_id,
+                node_ids=list(old_nodes) if scope is not None else None,
+            )
+            old_edges = {(r["source_id"], r["target_id"], r["type"]) async for r in result}
+
+            added = [node for node_id, node in new_nodes.items() if node_id not in old_nodes]
+            removed = [node_id for node_id in old_nodes if node_id not in parsed_nodes]
+            # touched: new, edited or still undocumented nodes (returned); changed: properties to write;
+            # stale: edited nodes whose old docstring is dropped
+            changed, touched, stale = [], [], []
+            for node_id, node in new_nodes.items():
+                old_node = old_nodes.get(node_id)
+                if old_node is None:
+                    touched.append(node)
+                    continue
+                if old_node["text_hash"] != node["text_hash"]:
+                    touched.append(node)
+                    changed.append(node)
+                    stale.append(node_id)
+                    continue
+                if old_node["undocumented"]:
+                    # Its docstring failed or was cleared on an earlier run
+                    touched.append(node)
+                if old_node["legacy"] or any(
+                    old_node[key] != node.get(key) for key in ("file_path", "start_line", "end_line", "name", "type")
+                ):
+                    changed.append(node)
+            added_edges = [edge for key, edge in new_edges.items() if key not in old_edges]
+            removed_edges = [
+                {"source_id": source_id, "target_id": target_id, "type": edge_type}
+                for source_id, target_id, edge_type in old_edges
+                if (source_id, target_id, edge_type) not in new_edges
+            ]
+            print(
+                f"Graph delta for {project_id}: +{len(added)} -{len(removed)} ~{len(changed)} nodes, "
+                f"+{len(added_edges)} -{len(removed_edges)} edges"
+            )
 
+            relationship_delta = 0
+            for i in range(0, len(removed_edges), batch_size):
+                summary = await self.awrite(
+                    session,
+                    """
+                    UNWIND $edges AS edge
+                    MATCH (:NODE {repoId: $repo_id, node_id: edge.source_id})-[r]->(:NODE {repoId: $repo_id, node_id: edge.target_id})
+                    WHERE type(r) = edge.type
+                    DELETE r
+                    """,
+                    edges=removed_edges[i : i + batch_size],
+                    repo_id=project_id,
+                )
+                relationship_delta -= summary.counters.relationships_deleted
+            for i in range(0, len(removed), batch_size):
+                summary = await self.awrite(
+                    session,
+                    """
+                    UNWIND $node_ids AS id
+                    MATCH (n:NODE {repoId: $repo_id, node_id: id})
+                    WITH n, n.embedding IS NOT NULL AS embedded
+                    DETACH DELETE n
+                    WITH sum(CASE WHEN embedded THEN 1 ELSE 0 END) AS removed
+                    MATCH (m:REPO_META {repoId: $repo_id})
+                    SET m.embedding_count = m.embedding_count - removed
+                    """,
+                    node_ids=removed[i : i + batch_size],
+                    repo_id=project_id,
+                )
+                relationship_delta -= summary.counters.relationships_deleted
+            for i in range(0, len(added), batch_size):
+                await self.awrite(
+                    session,
+                    """
+                    UNWIND $nodes AS node
+                    CALL apoc.create.node(node.labels, node.properties) YIELD node AS n
+                    RETURN count(*) AS created_count
+                    """,
+                    nodes=[self.label_split(node) for node in added[i : i + batch_size]],
+                )
+            for i in range(0, len(changed), batch_size):
+                await self.awrite(
+                    session,
+                    """
+                    UNWIND $nodes AS node
+                    MATCH (n:NODE {repoId: $repo_id, node_id: node.properties.node_id})
+                    SET n += node.properties
+                    REMOVE n.labels
+                    WITH n, node
+                    // A node whose type changed swaps its type label; NODE and the repo label stay
+                    CALL apoc.create.removeLabels(n, $type_labels) YIELD node AS unlabelled
+                    CALL apoc.create.addLabels(unlabelled, node.labels) YIELD node AS relabelled
+                    RETURN count(*) AS updated_count
+                    """,
+                    nodes=[self.label_split(node) for node in changed[i : i + batch_size]],
+                    type_labels=list(NODE_TYPE_LABELS),
+                    repo_id=project_id,
+                )
+            for i in range(0, len(stale), batch_size):
+                # The old docstring describes the old code; clearing it makes a failed regeneration retry next run
+                await self.awrite(
+                    session,
+                    """
+                    UNWIND $node_ids AS id
+                    MATCH (n:NODE {repoId: $repo_id, node_id: id})
+                    WITH n, n.embedding IS NOT NULL AS embedded
+                    SET n.docstring = NULL, n.embedding = NULL, n.tags = NULL
+                    WITH sum(CASE WHEN embedded THEN 1 ELSE 0 END) AS cleared
+                    MATCH (m:REPO_META {repoId: $repo_id})
+                    SET m.embedding_count = m.embedding_count - cleared
+                    """,
+                    node_ids=stale[i : i + batch_size],
+                    repo_id=project_id,
+                )
+            for i in range(0, len(added_edges), batch_size):
+                summary = await self.awrite(
+                    session,
+                    """
+                    UNWIND $edges AS edge
+                    MATCH (source:NODE {node_id: edge.source_id, repoId: edge.repoId})
+                    MATCH (target:NODE {node_id: edge.target_id, repoId: edge.repoId})
+                    CALL apoc.create.relationship(source, edge.type, {repoId: edge.repoId}, target) YIELD rel
+                    RETURN count(rel) AS created_count
+                    """,
+                    edges=added_edges[i : i + batch_size],
+                )
+                relationship_delta += summary.counters.relationships_created
+            if added or removed or changed or added_edges or removed_edges:
+                node_deltas = defaultdict(int)
+                for node in added:
+                    node_deltas[node["type"]] += 1
+                for node_id in removed:
+                    node_deltas[old_nodes[node_id]["type"]] -= 1
+                for node in changed:
+                    # A node whose type changed moves to another counter
+                    old_type = old_nodes[node["node_id"]]["type"]
+                    if old_type != node["type"]:
+                        node_deltas[old_type] -= 1
+                        node_deltas[node["type"]] += 1
+                await self.abump_graph_version(session, project_id, node_deltas, relationship_delta)
+
+        index = self.local_index(project_id)
+        if index is not None and (removed or stale):
+            index.remove(removed + stale, save=True)
+        return [
+            {key: node.get(key) for key in ("node_id", "text", "type", "name", "file_path", "start_line", "end_line")}
+            for node in touched
+        ]
+
+    def cleanup_neo4j(self, project_id: str="default", batch_size: Optional[int]=None) -> int:
+        return self._run_sync(self.acleanup_neo4j(project_id, batch_size))
+
+    async def acleanup_neo4j(self, project_id: str="default", batch_size: Optional[int]=None) -> int:
+        """Deletes one repo's nodes in bounded transactions, leaving other repos and the driver alone."""
+        batch_size = batch_size or int(os.getenv("NEO4J_DELETE_BATCH_SIZE", 10000))
+        deleted = 0
+        async with self.async_driver.session() as session:
+            while True:
+                # Each batch is its own auto-commit transaction, so heap use stays bounded
+                await self.db_writes.acquire()
+                try:
+                    result = await session.run(
+                        """
+                        MATCH (n:NODE {repoId: $repo_id})
+                        WITH n LIMIT $batch_size
+                        DETACH DELETE n
+                        RETURN count(*) AS deleted
+                        """,
+                        repo_id=project_id,
+                        batch_size=batch_size,
+                    )
+                    batch_deleted = (await result.single())["deleted"]
+                finally:
+                    self.db_writes.release()
+                if batch_deleted == 0:
+                    break
+                deleted += batch_deleted
+                print(f"Cleanup of {project_id}: deleted {deleted} nodes so far")
+            await self.abump_graph_version(session, project_id, reset_stats=True)
+        # Progress of earlier runs refers to nodes that no longer exist
+        RunLedger(project_id).clear()
+        index = self.local_index(project_id)
+        if index is not None:
+            index.clear()
+        print(f"Neo4j graph of {project_id} cleaned up successfully ({deleted} nodes).")
+        return deleted
     
-    def cleanup_neo4j(self):
-        print("This is a help function")
-        with self.driver.session() as session:
-            session.run("MATCH (n) DETACH DELETE n;")
-        self.driver.close()
-        print("Neo4j graph cleaned up successfully.")
-    
-    def create_vector_index(self):
-        with self.driver.session() as session:
-            session.run(
+    async def aensure_repo_meta(self, session):
+        if not self._repo_meta_constraint:
+            await session.run(
+                "CREATE CONSTRAINT repo_meta_repo_id IF NOT EXISTS FOR (m:REPO_META) REQUIRE m.repoId IS UNIQUE"
+            )
+            self._repo_meta_constraint = True
+
+    async def aget_graph_version(self, session, repo_id: str) -> Optional[str]:
+        """Opaque token on the repo's REPO_META node that changes whenever its graph is rewritten."""
+        # Read-only (query path); None means the repo was never written by this version, so do not cache
+        return (await self.aread_repo_meta(session, repo_id)).get("graph_version")
+
+    async def aread_repo_meta(self, session, repo_id: str) -> Dict:
+        result = await session.run(
+            """
+            MATCH (m:REPO_META {repoId: $repo_id})
+            RETURN m.graph_version AS graph_version, m.embedding_count AS embedding_count
+            """,
+            repo_id=repo_id,
+        )
+        record = await result.single()
+        return dict(record) if record else {}
+
+    async def abump_graph_version(
+        self,
+        session,
+        repo_id: str,
+        node_deltas: Optional[Dict[str, int]] = None,
+        relationship_delta: int = 0,
+        reset_stats: bool = False,
+        embedding_delta: int = 0,
+    ):
+        """Marks the repo's graph as changed and adds ``node_deltas`` (type -> nodes added) to its counters."""
+        # Counters that were never initialized stay unset until aget_graph_stats recounts
+        await self.aensure_repo_meta(session)
+        node_deltas = node_deltas or {}
+        deltas = {
+            "node_count": sum(node_deltas.values()),
+            "relationship_count": relationship_delta,
+            "embedding_count": embedding_delta,
+            **{f"{node_type}_count": node_deltas.get(node_type, 0) for node_type in GRAPH_STAT_TYPES},
+        }
+        if reset_stats:
+            updates = ", ".join(f"m.{key} = ${key}" for key in graph_stat_keys())
+        else:
+            updates = ", ".join(
+                f"m.{key} = CASE WHEN m.{key} IS NULL THEN NULL ELSE m.{key} + ${key} END" for key in graph_stat_keys()
+            )
+        # Not maintained without the local index, so it must not survive as a stale count
+        remove = "" if local_index_enabled() else " REMOVE m.embedding_count"
+        await session.run(
+            f"MERGE (m:REPO_META {{repoId: $repo_id}}) SET m.graph_version = randomUUID(), {updates}{remove}",
+            repo_id=repo_id,
+            **deltas,
+        )
+
+    def create_vector_index(self, repo_id: str="default"):
+        return self._run_sync(self.acreate_vector_index(repo_id))
+
+    async def acreate_vector_index(self, repo_id: str="default"):
+        async with self.async_driver.session() as session:
+            # Schema setup belongs to ingestion, never to the query path
+            await self.aensure_repo_meta(session)
+            await session.run(
                 """
                 CREATE VECTOR INDEX docstring_embedding IF NOT EXISTS
                 FOR (n:NODE)
@@ -658,14 +1903,40 @@ class InferenceService:
                 }}
                 """
             )
+            if partition_by_repo():
+                # A per-repo index means top-k never has to be filtered down to one repo
+                label = repo_partition_label(repo_id)
+                await session.run(
+                    f"""
+                    MATCH (n:NODE {{repoId: $repo_id}})
+                    CALL {{ WITH n SET n:`{label}` }} IN TRANSACTIONS OF 10000 ROWS
+                    """,
+                    repo_id=repo_id,
+                )
+                await session.run(
+                    f"""
+                    CREATE VECTOR INDEX `{vector_index_name(repo_id)}` IF NOT EXISTS
+                    FOR (n:`{label}`)
+                    ON (n.embedding)
+                    OPTIONS {{indexConfig: {{
+                        `vector.dimensions`: 384,
+                        `vector.similarity_function`: 'cosine'
+                    }}}}
+                    """
+                )
 
-    async def run_inference(self, repo_id: str="default"):
-        docstrings = await self.generate_docstrings(repo_id)
+    async def run_inference(self, repo_id: str="default", recent_files: Optional[List[str]]=None):
+        # The index exists before the first docstring, so nodes are searchable as soon as they are written
+        await self.acreate_vector_index(repo_id)
+        docstrings = await self.generate_docstrings(repo_id, recent_files)
         print(
             f"DEBUGNEO4J: After generate docstrings, Repo ID: {repo_id}, Docstrings: {len(docstrings)}"
         )
-        self.log_graph_stats(repo_id)
-        self.create_vector_index()
+        if flows_enabled():
+            await self.aset_progress_phase(repo_id, "flows")
+            await self.agenerate_flows(repo_id)
+        await self.aset_progress_phase(repo_id, "done")
+        await self.alog_graph_stats(repo_id)
 
 
     def query_vector_index(
@@ -675,65 +1946,181 @@ class InferenceService:
         project_id: str="default",
         top_k: int = 5,
     ) -> List[Dict]:
-        embedding = self.generate_embedding(query)
+        return self._run_sync(self.aquery_vector_index(query, node_ids, project_id, top_k))
 
-        with self.driver.session() as session:
+    async def aquery_vector_index(
+        self,
+        query: str,
+        node_ids: Optional[List[str]] = None,
+        project_id: str="default",
+        top_k: int = 5,
+    ) -> List[Dict]:
+        return (await self.aquery_vector_index_many([query], node_ids, project_id, top_k))[0]
+
+    def query_vector_index_many(
+        self,
+        queries: List[str],
+        node_ids: Optional[List[str]] = None,
+        project_id: str="default",
+        top_k: int = 5,
+    ) -> List[List[Dict]]:
+        return self._run_sync(self.aquery_vector_index_many(queries, node_ids, project_id, top_k))
+
+    async def aquery_vector_index_many(
+        self,
+        queries: List[str],
+        node_ids: Optional[List[str]] = None,
+        project_id: str="default",
+        top_k: int = 5,
+    ) -> List[List[Dict]]:
+        """Answers several questions with one encode call, one candidate search and one hydration query."""
+        if not queries:
+            return []
+        embeddings = await self.aembed_queries(queries)
+
+        async with self.async_driver.session() as session:
+            index = self.local_index(project_id)
+            meta = await self.aread_repo_meta(session, project_id) if node_ids else {}
+            context_node_ids = None
             if node_ids:
-                # Fetch context node IDs
-                result_neighbors = session.run(
-                    """
-                    MATCH (n:NODE)
-                    WHERE n.repoId = $project_id AND n.node_id IN $node_ids
-                    CALL {
-                        WITH n
-                        MATCH (n)-[*1..4]-(neighbor:NODE)
-                        RETURN COLLECT(DISTINCT neighbor.node_id) AS neighbor_ids
-                    }
-                    RETURN COLLECT(DISTINCT n.node_id) + REDUCE(acc = [], neighbor_ids IN COLLECT(neighbor_ids) | acc + neighbor_ids) AS context_node_ids
-                    """,
-                    project_id=project_id,
-                    node_ids=node_ids,
+                context_node_ids = await self.neighbourhood.expand(
+                    session, project_id, node_ids, meta.get("graph_version")
                 )
-                context_node_ids = result_neighbors.single()["context_node_ids"]
 
-                # Use vector index and filter by context_node_ids
-                result = session.run(
-                    """
-                    CALL db.index.vector.queryNodes('docstring_embedding', $initial_k, $embedding)
-                    YIELD node, score
-                    WHERE node.repoId = $project_id AND node.node_id IN $context_node_ids
-                    RETURN node.node_id AS node_id,
-                        node.docstring AS docstring,
-                        node.file_path AS file_path,
-                        node.start_line AS start_line,
-                        node.end_line AS end_line,
-                        score AS similarity
-                    ORDER BY similarity DESC
-                    LIMIT $top_k
-                    """,
-                    project_id=project_id,
-                    embedding=embedding,
-                    context_node_ids=context_node_ids,
-                    initial_k=top_k * 10,  # Adjust as needed
-                    top_k=top_k,
-                )
+            index_complete = False
+            if index is not None:
+                # An ingestion run may have saved a newer mirror since it was loaded
+                index.reload_if_changed()
+                checked = self._index_complete.get(project_id)
+                if checked is None or checked[0] != index.state:
+                    # Compared with Neo4j only when the mirror changed, not on every question
+                    if not meta:
+                        meta = await self.aread_repo_meta(session, project_id)
+                    checked = self._index_complete[project_id] = (
+                        index.state,
+                        bool(len(index)) and len(index) == meta.get("embedding_count"),
+                    )
+                index_complete = checked[1]
+            if index_complete:
+                # Candidates come from the in-process mirror, trusted only while it holds every
+                # embedded node (not after a crashed run); Neo4j is only used to hydrate them
+                candidates = index.search_many(embeddings, top_k, allowed=context_node_ids)
+            elif context_node_ids is not None and len(context_node_ids) <= EXACT_SEARCH_MAX_NODES:
+                candidates = await self.aexact_candidates(session, embeddings, context_node_ids, project_id, top_k)
             else:
-                result = session.run(
-                    """
-                    CALL db.index.vector.queryNodes('docstring_embedding', $top_k, $embedding)
-                    YIELD node, score
-                    WHERE node.repoId = $project_id
-                    RETURN node.node_id AS node_id,
-                        node.docstring AS docstring,
-                        node.file_path AS file_path,
-                        node.start_line AS start_line,
-                        node.end_line AS end_line,
-                        score AS similarity
-                    """,
-                    project_id=project_id,
-                    embedding=embedding,
-                    top_k=top_k,
-                )
+                # The ANN rows already carry the node fields, so there is nothing to hydrate
+                return await self.aindex_candidates(session, embeddings, project_id, top_k, context_node_ids)
+
+            result = await session.run(
+                """
+                UNWIND $node_ids AS id
+                MATCH (node:NODE {repoId: $project_id, node_id: id})
+                RETURN node.node_id AS node_id,
+                    node.docstring AS docstring,
+                    node.file_path AS file_path,
+                    node.start_line AS start_line,
+                    node.end_line AS end_line
+                """,
+                project_id=project_id,
+                node_ids=list({node_id for hits in candidates for node_id, _ in hits}),
+            )
+            nodes = {record["node_id"]: dict(record) async for record in result}
+
+        # Ensure all fields are included in the final output
+        return [
+            [{**nodes[node_id], "similarity": similarity} for node_id, similarity in hits if node_id in nodes]
+            for hits in candidates
+        ]
+
+    async def aembed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embeds questions in one call, reusing vectors of questions asked earlier in the session."""
+        vectors = {query: self._query_embeddings[query] for query in queries if query in self._query_embeddings}
+        missing = [query for query in dict.fromkeys(queries) if query not in vectors]
+        if missing:
+            # Straight to the encoder: the micro-batcher's wait would dominate a single question
+            vectors.update(zip(missing, await self.embeddings.aencode_many(missing)))
+        for query, vector in vectors.items():
+            self._query_embeddings[query] = vector
+            self._query_embeddings.move_to_end(query)
+        while len(self._query_embeddings) > QUERY_EMBEDDING_CACHE_SIZE:
+            self._query_embeddings.popitem(last=False)
+        return np.stack([vectors[query] for query in queries])
+
+    async def aexact_candidates(self, session, embeddings: np.ndarray, node_ids, project_id: str, top_k: int):
+        """Scores a small candidate set exactly instead of going through the ANN index."""
+        result = await session.run(
+            """
+            UNWIND $node_ids AS id
+            MATCH (n:NODE {repoId: $project_id, node_id: id})
+            WHERE n.embedding IS NOT NULL
+            RETURN n.node_id AS node_id, n.embedding AS embedding
+            """,
+            project_id=project_id,
+            node_ids=list(node_ids),
+        )
+        records = [record async for record in result]
+        if not records:
+            return [[] for _ in range(len(embeddings))]
+        return exact_top_k_many(
+            embeddings,
+            [record["node_id"] for record in records],
+            np.array([record["embedding"] for record in records], dtype=np.float32),
+            top_k,
+        )
+
+    async def aindex_candidates(
+        self, session, embeddings: np.ndarray, project_id: str, top_k: int, allowed=None
+    ) -> List[List[Dict]]:
+        """Queries the vector index for every embedding at once, doubling k until ``top_k`` hits pass the filter."""
+        index_name = vector_index_name(project_id)
+        filtered = allowed is not None or index_name == GLOBAL_VECTOR_INDEX
+        initial_k = min(top_k * 10 if filtered else top_k, VECTOR_SEARCH_MAX_K)
+        pending = {query_index: initial_k for query_index in range(len(embeddings))}
+        hits = [[] for _ in range(len(embeddings))]
+        while pending:
+            result = await session.run(
+                """
+                UNWIND $requests AS request
+                CALL db.index.vector.queryNodes($index_name, request.k, request.embedding)
+                YIELD node, score
+                RETURN request.query_index AS query_index,
+                    node.node_id AS node_id,
+                    node.repoId AS repo_id,
+                    node.docstring AS docstring,
+                    node.file_path AS file_path,
+                    node.start_line AS start_line,
+                    node.end_line AS end_line,
+                    score AS similarity
+                """,
+                index_name=index_name,
+                requests=[
+                    {"query_index": query_index, "k": k, "embedding": embeddings[query_index].tolist()}
+                    for query_index, k in pending.items()
+                ],
+            )
+            records = defaultdict(list)
+            async for record in result:
+                records[record["query_index"]].append(record)
+            next_pending = {}
+            for query_index, k in pending.items():
+                query_records = records[query_index]
+                hits[query_index] = [
+                    {
+                        key: record[key]
+                        for key in ("node_id", "docstring", "file_path", "start_line", "end_line", "similarity")
+                    }
+                    for record in query_records
+                    if record["repo_id"] == project_id and (allowed is None or record["node_id"] in allowed)
+                ]
+                # Stop once there are enough hits, the index is exhausted or k hits its cap
+                if len(hits[query_index]) < top_k and len(query_records) == k and k < VECTOR_SEARCH_MAX_K:
+                    next_pending[query_index] = min(k * 2, VECTOR_SEARCH_MAX_K)
+            pending = next_pending
+        return [query_hits[:top_k] for query_hits in hits]
+
+registry.register("inference_service", InferenceService, lambda service: service.close())
+
 
-            # Ensure all fields are included in the final output
-            return [dict(record) for record in result]
+def get_inference_service() -> InferenceService:
+    """The process-wide InferenceService used by the agent tools."""
+    return registry.get("inference_service")
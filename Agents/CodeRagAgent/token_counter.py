@@ -0,0 +1,72 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Sequence
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> "tiktoken.Encoding":
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        logger.warning(f"Warning: model {model} not found. Using cl100k_base encoding.")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+class TokenCounter:
+    """tiktoken token counts with a cached encoder and an LRU memo keyed by text hash."""
+
+    def __init__(self, default_model: str = "gpt-4", max_entries: int = 500000, num_threads: int = None):
+        self.default_model = default_model
+        self.max_entries = max_entries
+        self.num_threads = num_threads or int(os.getenv("TOKENIZER_THREADS", os.cpu_count() or 4))
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def approx_count(text: str) -> int:
+        """Cheap upper-bound-ish estimate (~4 characters per token) for pacing and packing heuristics."""
+        return (len(text) + 3) // 4
+
+    @staticmethod
+    def _key(text: str, encoding_name: str):
+        return encoding_name, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def count(self, text: str, model: str = None) -> int:
+        return self.count_many([text], model)[0]
+
+    def count_many(self, texts: Sequence[str], model: str = None) -> List[int]:
+        """Counts tokens for many texts, encoding only unseen ones in one threaded batch."""
+        encoding = get_encoding(model or self.default_model)
+        keys = [self._key(text, encoding.name) for text in texts]
+        counts = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                count = self._counts.get(key)
+                if count is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    self._counts.move_to_end(key)
+                    counts[i] = count
+
+        if missing:
+            missing_keys = list(missing)
+            encoded = encoding.encode_ordinary_batch(
+                [texts[missing[key][0]] for key in missing_keys],
+                num_threads=self.num_threads,
+            )
+            with self._lock:
+                for key, tokens in zip(missing_keys, encoded):
+                    for i in missing[key]:
+                        counts[i] = len(tokens)
+                    self._counts[key] = len(tokens)
+                while len(self._counts) > self.max_entries:
+                    self._counts.popitem(last=False)
+        return counts
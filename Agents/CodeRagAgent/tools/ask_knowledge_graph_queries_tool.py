@@ -25,7 +25,7 @@ def KnowledgeGraphQueryTool(input_str: str) -> List[Dict]:
 
     "node_ids" is an optional field
     """
-    from Agents.CodeRagAgent.service import InferenceService
+    from Agents.CodeRagAgent.service import get_inference_service
     input_str = re.search(r'\{.*\}', input_str).group(0)
     print(input_str)
     input_data = json.loads(input_str) if isinstance(input_str, str) else input_str
@@ -39,18 +39,5 @@ def KnowledgeGraphQueryTool(input_str: str) -> List[Dict]:
         queries = [str(input_data)]
         node_ids = None
     
-    results = []
-    for query in queries:
-        query_request = create_query_request(query, node_ids)
-        result = InferenceService().query_vector_index(query_request.query, query_request.node_ids)
-        results.append(result)
-    return results
-
-def create_query_request(query: str, node_ids: Optional[List[str]]):
-    """Create a query request object with the necessary structure"""
-    class QueryRequest:
-        def __init__(self, query, node_ids):
-            self.query = query
-            self.node_ids = node_ids
-    
-    return QueryRequest(query, node_ids)
\ No newline at end of file
+    # All questions share one embedding call and one vector search
+    return get_inference_service().query_vector_index_many(queries, node_ids)
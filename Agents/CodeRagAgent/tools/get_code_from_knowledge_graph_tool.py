@@ -7,7 +7,7 @@ from langchain_core.tools import StructuredTool
 from neo4j import GraphDatabase
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
-from Agents.CodeRagAgent.service import InferenceService
+from Agents.CodeRagAgent.resources import registry
 
 class GetCodeFromNodeIdInput(BaseModel):
     project_id: str = Field(description="The repository ID, this is a UUID")
@@ -29,7 +29,8 @@ def _get_node_data(project_id: str, node_id: str) -> Dict[str, Any]:
     MATCH (n:NODE {node_id: $node_id, repoId: $project_id})
     RETURN n.file_path AS file_path, n.start_line AS start_line, n.end_line AS end_line, n.text as code, n.docstring as docstring
     """
-    with InferenceService().driver.session() as session:
+    # Only the shared driver is needed here, not the models a full InferenceService loads
+    with registry.get("neo4j_driver").session() as session:
         result = session.run(query, node_id=node_id, project_id=project_id)
         return result.single()
 
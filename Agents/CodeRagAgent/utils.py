@@ -1,5 +1,7 @@
+import asyncio
 import hashlib
 import logging
+import threading
 import matplotlib.pyplot as plt
 import networkx as nx
 
@@ -50,3 +52,29 @@ def generate_node_id(path: str):
     node_id = hash_object.hexdigest()
 
     return node_id
+
+class BackgroundLoop:
+    """Event loop running in a daemon thread, used to drive coroutines from sync code."""
+
+    def __init__(self):
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def run(self, coro):
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+                self._thread.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def stop(self):
+        with self._lock:
+            if self.loop is None:
+                return
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
+            self.loop = None
+            self._thread = None
@@ -0,0 +1,60 @@
+import hashlib
+import os
+import re
+from typing import List, Sequence, Tuple
+import numpy as np
+
+GLOBAL_VECTOR_INDEX = "docstring_embedding"
+
+# Filtered searches over at most this many nodes skip the ANN index and score them exactly.
+# Each candidate's embedding crosses Bolt, so this stays well below NEIGHBOUR_MAX_NODES
+EXACT_SEARCH_MAX_NODES = int(os.getenv("EXACT_SEARCH_MAX_NODES", 200))
+# Upper bound for the adaptive k of an ANN query
+VECTOR_SEARCH_MAX_K = int(os.getenv("VECTOR_SEARCH_MAX_K", 10000))
+
+
+def partition_by_repo() -> bool:
+    """VECTOR_INDEX_PER_REPO=1 gives every repo its own label and vector index."""
+    return os.getenv("VECTOR_INDEX_PER_REPO", "0") == "1"
+
+
+def repo_partition_label(repo_id: str) -> str:
+    # Labels cannot be parameterized, so the repo id is sanitized and a hash keeps them distinct
+    digest = hashlib.md5(repo_id.encode("utf-8")).hexdigest()[:8]
+    return f"REPO_{re.sub(r'[^A-Za-z0-9]', '_', repo_id)[:40]}_{digest}"
+
+
+def safe_file_name(name: str) -> str:
+    # Names that need sanitizing get a hash, so ids like ``a/b`` and ``a_b`` keep separate files
+    sanitized = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+    if sanitized == name:
+        return name
+    return f"{sanitized[:80]}_{hashlib.md5(name.encode('utf-8')).hexdigest()[:8]}"
+
+
+def vector_index_name(repo_id: str) -> str:
+    if not partition_by_repo():
+        return GLOBAL_VECTOR_INDEX
+    return f"{GLOBAL_VECTOR_INDEX}_{repo_partition_label(repo_id).lower()}"
+
+
+def exact_top_k_many(
+    queries: np.ndarray, node_ids: Sequence[str], embeddings: np.ndarray, top_k: int, normalized: bool = False
+) -> List[List[Tuple[str, float]]]:
+    """Brute-force ``(1 + cos) / 2`` scores (Neo4j's cosine scale) of each query row, best ``top_k`` first."""
+    queries = np.asarray(queries, dtype=np.float32)
+    if len(node_ids) == 0:
+        return [[] for _ in range(len(queries))]
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    # ``normalized`` callers pass unit-length rows already
+    if not normalized:
+        embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+    queries = queries / np.clip(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12, None)
+    scores = (1 + queries @ embeddings.T) / 2
+    k = min(top_k, len(node_ids))
+    results = []
+    for query_scores in scores:
+        best = np.argpartition(-query_scores, k - 1)[:k]
+        best = best[np.argsort(-query_scores[best])]
+        results.append([(node_ids[i], float(query_scores[i])) for i in best])
+    return results
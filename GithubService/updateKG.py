@@ -1,4 +1,8 @@
 import asyncio
+import os
+from Agents.CodeRagAgent.ingestion_scheduler import IngestionJob, IngestionScheduler
+from Agents.CodeRagAgent.priority import recent_files_from_git
+from Agents.CodeRagAgent.resources import registry
 from Agents.CodeRagAgent.service import InferenceService
 from dotenv import load_dotenv
 import asyncio
@@ -6,38 +10,73 @@ from GithubService.githubService import clone_github_repo
 import argparse
 load_dotenv()
 
+def repo_name(source: str) -> str:
+    return os.path.basename(source.rstrip("/\\")).removesuffix(".git")
+
 def main():
     # Set up argument parser
-    parser = argparse.ArgumentParser(description='Process a GitHub repo or local directory for inference.')
-    parser.add_argument('--github-url', type=str, help='URL of the GitHub repository')
-    parser.add_argument('--repo-dir', type=str, help='Path to local repository directory')
-    
+    parser = argparse.ArgumentParser(description='Process GitHub repos or local directories for inference.')
+    parser.add_argument('--github-url', type=str, nargs='+', help='URL(s) of the GitHub repositories')
+    parser.add_argument('--repo-dir', type=str, nargs='+', help='Path(s) to local repository directories')
+    parser.add_argument('--repo-id', type=str, nargs='+', help='Repo id per repository, in order (default: "default" for one repo, the repo name for several)')
+    parser.add_argument('--source-subdir', type=str, help='Directory inside each repository to parse')
+    parser.add_argument('--max-concurrent-repos', type=int, help='Repositories ingested at the same time')
+    parser.add_argument('--bulk-export-dir', type=str, help='Write neo4j-admin import CSVs to this directory instead of loading over Bolt')
+    parser.add_argument('--full-rebuild', action='store_true', help='Wipe the graph and rebuild it from scratch instead of applying only the changes')
+
     # Parse arguments
     args = parser.parse_args()
 
-    # Initialize variables
-    repo_dir = None
-    changed_files = [-1]
-
-    # Check which argument was provided
-    if args.github_url:
-        repo_dir, changed_files = clone_github_repo(args.github_url)
-    elif args.repo_dir:
-        repo_dir = args.repo_dir
-    else:
+    sources = (args.github_url or []) + (args.repo_dir or [])
+    if not sources:
         parser.error("Please provide either --github-url or --repo-dir")
         return
-    
-    
-    clean_up = True
+    if args.repo_id and len(args.repo_id) != len(sources):
+        parser.error("--repo-id needs one id per repository")
+        return
+    repo_ids = args.repo_id or (["default"] if len(sources) == 1 else [repo_name(source) for source in sources])
+
+    # Clone the GitHub repositories; local directories are used as they are
+    repo_dirs = []
+    changed_files = [-1]
+    for repo_id, github_url in zip(repo_ids, args.github_url or []):
+        local_path = "cloned_repo" if len(sources) == 1 else os.path.join("cloned_repos", repo_id)
+        repo_dir, changed_files = clone_github_repo(github_url, local_path)
+        repo_dirs.append(repo_dir)
+    repo_dirs += args.repo_dir or []
+
+
     # Run the inference service
     service = InferenceService()
-    service.project_updates(repo_dir,changed_files,clean_up)
-    if clean_up:
-        asyncio.run(service.run_inference())
+    if args.bulk_export_dir:
+        # Each repo gets its own import files, in a subdirectory named after its repo id
+        for repo_id, repo_dir in zip(repo_ids, repo_dirs):
+            export_dir = args.bulk_export_dir if len(repo_dirs) == 1 else os.path.join(args.bulk_export_dir, repo_id)
+            files = service.project_setup(repo_dir, export_dir=export_dir, project_id=repo_id)
+            if len(repo_dirs) == 1:
+                print(f"Run {files['import_script']} to load the graph, then run inference.")
+            else:
+                # import.sh replaces the whole database, so several repos are loaded online
+                print(f"Load {repo_id} with {files['load_csv_script']}, then run inference.")
+        return
+
+    # Fail fast on an unreachable database or bad credentials before spending time on parsing;
+    # creating the driver alone does not connect
+    registry.warm_up(["neo4j_driver", "llm_client", "embeddings"])
+    registry.get("neo4j_driver").verify_connectivity()
+    if len(repo_dirs) > 1 or args.source_subdir:
+        jobs = [
+            IngestionJob(repo_id, repo_dir, args.full_rebuild, args.source_subdir)
+            for repo_id, repo_dir in zip(repo_ids, repo_dirs)
+        ]
+        results = IngestionScheduler(service, args.max_concurrent_repos).run(jobs)
+        if any(result.error for result in results.values()):
+            raise SystemExit(1)
+    elif args.full_rebuild:
+        service.project_updates(repo_dirs[0],changed_files,cleanup=True,project_id=repo_ids[0])
+        asyncio.run(service.run_inference(repo_ids[0], recent_files_from_git(repo_dirs[0])))
+    else:
+        service.project_updates(repo_dirs[0],changed_files,project_id=repo_ids[0])
 
 if __name__ == "__main__":
     main()
-
-
-    
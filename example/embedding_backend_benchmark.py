@@ -0,0 +1,40 @@
+import time
+import numpy as np
+from Agents.CodeRagAgent.embedding_backends import PARITY_THRESHOLDS, create_embedding_backend
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+
+def sample_texts(count):
+    snippets = [
+        "public Account withdraw(BigDecimal amount) throws InsufficientFundsException",
+        "Transfers money between two accounts and records both transactions.",
+        "class BankingService implements TransactionService",
+        "Returns the list of customers whose balance is below the minimum.",
+        "def process_nodes(self, nodes, repo_id): expand references and batch docstrings",
+    ]
+    return [f"{snippets[i % len(snippets)]} #{i}" * (1 + i % 4) for i in range(count)]
+
+
+def main():
+    texts = sample_texts(512)
+    reference = create_embedding_backend(MODEL_NAME, "sentence-transformers")
+    expected = reference.encode(texts)
+
+    for name in ("sentence-transformers", "onnx", "onnx-int8"):
+        backend = reference if name == "sentence-transformers" else create_embedding_backend(MODEL_NAME, name)
+        backend.encode(texts[:8])  # warm up
+        start = time.perf_counter()
+        vectors = backend.encode(texts)
+        elapsed = time.perf_counter() - start
+        cosine = np.sum(vectors * expected, axis=1)
+        print(
+            f"{name:>22}: {len(texts) / elapsed:8.1f} texts/s, "
+            f"cosine vs pytorch mean={cosine.mean():.4f} min={cosine.min():.4f}"
+        )
+        if name in PARITY_THRESHOLDS and cosine.mean() < PARITY_THRESHOLDS[name]:
+            raise SystemExit(f"{name} vectors drift from the PyTorch model (mean cosine {cosine.mean():.4f})")
+
+
+if __name__ == "__main__":
+    main()
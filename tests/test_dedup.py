@@ -0,0 +1,30 @@
+from Agents.CodeRagAgent.dedup import group_duplicates, normalize, rename_docstring
+
+
+def test_getters_differing_only_in_names_are_merged():
+    texts = {
+        "a": "public String getName() {\n    return name;\n}",
+        "b": "public String getAge()  { return age; }",
+    }
+    groups = group_duplicates(texts)
+    assert groups.members == {"a": ["b"]}
+    docstring = rename_docstring("Returns name via getName.", groups.identifiers["a"], groups.identifiers["b"])
+    assert docstring == "Returns age via getAge."
+
+
+def test_bodies_with_different_callees_are_not_merged():
+    texts = {
+        "save": "void save() { repo.save(x); }",
+        "delete": "void delete() { repo.delete(x); }",
+    }
+    assert group_duplicates(texts).members == {}
+
+
+def test_bare_calls_are_kept_verbatim():
+    assert normalize("def a(x):\n    return load(x)")[0] != normalize("def b(y):\n    return drop(y)")[0]
+    assert normalize("def a(x):\n    return load(x)")[0] == normalize("def b(y):\n    return load(y)")[0]
+
+
+def test_node_kinds_must_match():
+    texts = {"a": "int size() { return n; }", "b": "int size() { return n; }"}
+    assert group_duplicates(texts, {"a": "FUNCTION", "b": "INTERFACE"}).members == {}
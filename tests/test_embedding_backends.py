@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("sentence_transformers")
+
+from Agents.CodeRagAgent.embedding_backends import PARITY_THRESHOLDS, create_embedding_backend
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+TEXTS = [
+    "public Account withdraw(BigDecimal amount) throws InsufficientFundsException",
+    "Transfers money between two accounts and records both transactions.",
+    "class BankingService implements TransactionService",
+    "Returns the list of customers whose balance is below the minimum.",
+    "def process_nodes(self, nodes, repo_id): expand references and batch docstrings",
+]
+
+
+@pytest.fixture(scope="module")
+def reference_vectors():
+    return create_embedding_backend(MODEL_NAME, "sentence-transformers").encode(TEXTS)
+
+
+@pytest.mark.parametrize("backend", sorted(PARITY_THRESHOLDS))
+def test_onnx_backends_match_pytorch(backend, reference_vectors):
+    vectors = create_embedding_backend(MODEL_NAME, backend).encode(TEXTS)
+    assert vectors.shape == reference_vectors.shape
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-3)
+    cosine = np.sum(vectors * reference_vectors, axis=1)
+    assert cosine.mean() >= PARITY_THRESHOLDS[backend]